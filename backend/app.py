@@ -4,10 +4,12 @@ Flask + Server-Sent Events для streaming
 """
 
 import asyncio
+import atexit
 import os
 import time
 import uuid
 import logging
+from logging.handlers import QueueHandler, QueueListener
 from flask import Flask, render_template, request, Response, jsonify, stream_with_context, g, send_from_directory
 from flask_cors import CORS
 from werkzeug.exceptions import HTTPException
@@ -20,8 +22,15 @@ except ImportError:
 import json
 import queue
 import threading
-
-app = Flask(__name__, template_folder='templates', static_folder='static')
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+# static_folder=None: папки static нет, фронтенд отдаётся через /frontend/<path>
+app = Flask(__name__, template_folder='templates', static_folder=None)
+# Порядок ключей в ответах не важен — не сортируем их на каждый jsonify
+app.json.sort_keys = False
+# Ответы (reply, tour_cards) почти целиком кириллица — отдаём UTF-8 как есть, без \uXXXX
+app.json.ensure_ascii = False
 CORS(app)
 
 # === ЛОГИРОВАНИЕ ===
@@ -38,6 +47,57 @@ _DIALOGUE_LOG_PATH = os.path.join(
 )
 
 
+# Иконки направлений диалогового лога
+_DIALOGUE_ICONS = {
+    "USER": "👤", "ASSISTANT": "🤖", "FUNC_CALL": "🔧",
+    "FUNC_RESULT": "📦", "API_RAW": "🌐", "ERROR": "❌", "SYSTEM": "⚙️",
+    "TOUR_CARDS": "🎴"
+}
+
+
+# Звёздность отеля в логе карточек: строки для 0–5 ⭐ собраны заранее
+_STARS_DISPLAY = tuple("⭐" * n for n in range(6))
+
+
+def _stars_display(stars: int) -> str:
+    """Звёзды отеля для лога карточек ('⭐⭐⭐⭐' для 4*)"""
+    if 0 <= stars < len(_STARS_DISPLAY):
+        return _STARS_DISPLAY[stars]
+    return "⭐" * stars
+
+
+# Разделитель разрядов цены: 145,000 → 145 000
+_THOUSANDS_TO_SPACE = str.maketrans(",", " ")
+
+
+def _format_price(price) -> str:
+    """Цена для лога карточек; нечисловое значение ('?') выводится как есть"""
+    if isinstance(price, int):
+        return f"{price:,}".translate(_THOUSANDS_TO_SPACE)
+    return str(price)
+
+
+def _plural_nights(n: int) -> str:
+    """Склонение слова «ночь» по числу"""
+    if n % 10 == 1 and n % 100 != 11:
+        return "ночь"
+    if 2 <= n % 10 <= 4 and not 12 <= n % 100 <= 14:
+        return "ночи"
+    return "ночей"
+
+
+# Туры бывают до 30 ночей — формы слова для них собраны заранее
+_NIGHT_WORDS = tuple(_plural_nights(n) for n in range(31))
+
+
+def _format_nights(nights) -> str:
+    """'7 ночей', '1 ночь', '3 ночи' для лога карточек"""
+    if not isinstance(nights, int):
+        return f"{nights} ночей"
+    word = _NIGHT_WORDS[nights] if 0 <= nights < len(_NIGHT_WORDS) else _plural_nights(nights)
+    return f"{nights} {word}"
+
+
 def _write_dialogue_log(session_id: str, direction: str, content: str):
     """
     Пишет в человекочитаемый диалоговый лог (markdown).
@@ -45,27 +105,24 @@ def _write_dialogue_log(session_id: str, direction: str, content: str):
     """
     ts = _dt.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
     sid = session_id[:8] if session_id else "--------"
-    icons = {
-        "USER": "👤", "ASSISTANT": "🤖", "FUNC_CALL": "🔧",
-        "FUNC_RESULT": "📦", "API_RAW": "🌐", "ERROR": "❌", "SYSTEM": "⚙️",
-        "TOUR_CARDS": "🎴"
-    }
-    icon = icons.get(direction, "📝")
-    try:
-        with open(_DIALOGUE_LOG_PATH, "a", encoding="utf-8") as f:
-            f.write(f"\n### [{ts}] {icon} {direction} (session: {sid})\n")
-            f.write(f"```\n{content}\n```\n")
-    except Exception:
-        pass  # лог не должен ломать приложение
+    icon = _DIALOGUE_ICONS.get(direction, "📝")
+    # Запись в файл делает фоновый поток — запрос только ставит запись в очередь
+    _dialogue_log_queue.put(f"\n### [{ts}] {icon} {direction} (session: {sid})\n```\n{content}\n```\n")
 
 
 def _setup_logging() -> logging.Logger:
     """
     Единая настройка логирования в консоль + файл.
+    Запись неблокирующая: потоки запросов только кладут запись в очередь
+    (QueueHandler), вывод в консоль/файл делает фоновый QueueListener.
     Управление:
       - LOG_LEVEL=DEBUG|INFO|WARNING|ERROR (по умолчанию INFO)
     """
     logger = logging.getLogger("mgp_bot")
+    # Повторный вызов (второй импорт модуля, тесты) — логирование уже настроено:
+    # не добавляем второй QueueHandler, QueueListener и файл лога (иначе записи дублируются)
+    if any(isinstance(h, QueueHandler) for h in logger.handlers):
+        return logger
 
     level_name = os.getenv("LOG_LEVEL", "INFO").upper()
     level = getattr(logging, level_name, logging.INFO)
@@ -77,12 +134,7 @@ def _setup_logging() -> logging.Logger:
     )
 
     # --- Console handler ---
-    if logger.handlers:
-        handler = logger.handlers[0]
-    else:
-        handler = logging.StreamHandler()
-        logger.addHandler(handler)
-
+    handler = logging.StreamHandler()
     handler.setLevel(level)
     handler.setFormatter(formatter)
 
@@ -97,7 +149,14 @@ def _setup_logging() -> logging.Logger:
         fmt="%(asctime)s.%(msecs)03d %(levelname)s [%(name)s] %(message)s",
         datefmt="%Y-%m-%d %H:%M:%S",
     ))
-    logger.addHandler(file_handler)
+
+    # --- Очередь: консоль и файл обслуживаются в отдельном потоке ---
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    listener = QueueListener(log_queue, handler, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)  # дописать очередь при остановке
+    logger.addHandler(queue_handler)
 
     # WerkZeug: по умолчанию скрываем access-логи (они дублируют наши -> / <-).
     # При необходимости можно включить обратно через WERKZEUG_LOG_LEVEL=INFO.
@@ -106,8 +165,7 @@ def _setup_logging() -> logging.Logger:
     werk_level = getattr(logging, werk_level_name, logging.WARNING)
     werk_logger.setLevel(werk_level)
     if not werk_logger.handlers:
-        werk_logger.addHandler(handler)
-        werk_logger.addHandler(file_handler)
+        werk_logger.addHandler(queue_handler)
     else:
         # на случай, если handler уже был, приведём его к одному формату
         for h in werk_logger.handlers:
@@ -122,63 +180,167 @@ def _setup_logging() -> logging.Logger:
 
 logger = _setup_logging()
 
+# Прогреваем кэши handler'а (схемы функций, промпт) до первого запроса
+YandexGPTHandler.preload()
+
+# Диалоговый лог держим открытым всё время работы процесса.
+# Пишет его один фоновый поток: записи копятся в очереди и сбрасываются
+# пачкой — один write+flush на все записи, накопившиеся за время предыдущего.
+_dialogue_log_file = open(_DIALOGUE_LOG_PATH, "w", encoding="utf-8")
+_dialogue_log_queue: "queue.SimpleQueue[Optional[str]]" = queue.SimpleQueue()
+
 # Записываем заголовок диалогового лога
-with open(_DIALOGUE_LOG_PATH, "w", encoding="utf-8") as _f:
-    _f.write(f"# 📝 Диалоговый лог AI-Турменеджера МГП\n")
-    _f.write(f"**Дата:** {_dt.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
-    _f.write(f"---\n")
-
-
-def log(msg: str, level: str = "INFO"):
-    """Совместимость со старым логгером (level=INFO/OK/WARN/ERROR/MSG/FUNC)."""
-    level_map = {
-        "INFO": logging.INFO,
-        "OK": logging.INFO,
-        "WARN": logging.WARNING,
-        "ERROR": logging.ERROR,
-        "MSG": logging.INFO,
-        "FUNC": logging.DEBUG,
-    }
-    py_level = level_map.get(level, logging.INFO)
-    logger.log(py_level, f"[{level}] {msg}")
+_dialogue_log_file.write(
+    f"# 📝 Диалоговый лог AI-Турменеджера МГП\n"
+    f"**Дата:** {_dt.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n"
+    f"---\n"
+)
+_dialogue_log_file.flush()
+
+
+def _dialogue_log_writer():
+    """Фоновая запись диалогового лога (None в очереди — остановка)"""
+    while True:
+        batch = [_dialogue_log_queue.get()]
+        while True:
+            try:
+                batch.append(_dialogue_log_queue.get_nowait())
+            except queue.Empty:
+                break
+        stop = None in batch
+        try:
+            _dialogue_log_file.write("".join(e for e in batch if e is not None))
+            _dialogue_log_file.flush()
+        except Exception:
+            pass  # лог не должен ломать приложение
+        if stop:
+            return
+
+
+_dialogue_log_thread = threading.Thread(target=_dialogue_log_writer, name="dialogue-log", daemon=True)
+_dialogue_log_thread.start()
+
+
+@atexit.register
+def _close_dialogue_log():
+    """Дописать очередь диалогового лога и закрыть файл при остановке"""
+    _dialogue_log_queue.put(None)
+    _dialogue_log_thread.join(timeout=5)
+    _dialogue_log_file.close()
+
 
 # === УПРАВЛЕНИЕ СЕССИЯМИ ===
-# Thread-safe хранилище сессий с автоочисткой
+# Thread-safe хранилище сессий с автоочисткой.
+# OrderedDict в порядке последней активности: в конце — самые свежие сессии,
+# при превышении MAX_SESSIONS вытесняем самые давние (LRU).
 _handlers_lock = threading.Lock()
-_handlers: dict[str, dict] = {}  # session_id → {"handler": YandexGPTHandler, "last_active": float}
+# session_id → {"handler": YandexGPTHandler, "lock": threading.Lock, "in_use": int, "last_active": float (time.monotonic)}
+# lock сериализует запросы ОДНОЙ сессии: handler хранит историю и previous_response_id,
+# два параллельных chat() на нём перемешали бы контекст диалога.
+# in_use — число запросов, получивших сессию и ещё не завершившихся: такие сессии
+# не вытесняются и не чистятся, иначе handler закрылся бы посреди хода.
+_handlers: "OrderedDict[str, dict]" = OrderedDict()
 SESSION_TTL_SECONDS = 30 * 60  # 30 минут неактивности → удаление
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "500"))  # лимит одновременно хранимых сессий
+SESSION_CLEANUP_INTERVAL_SECONDS = 5 * 60  # период фоновой очистки
+
+
+def _close_handler(session_id: str, handler: YandexGPTHandler):
+    """Закрыть ресурсы handler'а удаляемой сессии (ошибки не пробрасываем)"""
+    try:
+        handler.close_sync()
+    except Exception:
+        logger.debug("close_sync failed for session %s", session_id[:8], exc_info=True)
+
+
+def _close_turn_loop(handler: YandexGPTHandler, loop: asyncio.AbstractEventLoop):
+    """
+    Завершить event loop хода: закрыть пул соединений TourVisor (он привязан к loop'у)
+    и сам loop. Ошибка закрытия пула только логируется — исходная ошибка хода не подменяется.
+    """
+    try:
+        loop.run_until_complete(handler.tourvisor.close())
+    except Exception:
+        logger.warning("tourvisor close failed", exc_info=True)
+    finally:
+        loop.close()
 
 
-def get_handler(session_id: str) -> YandexGPTHandler:
-    """Получить или создать handler для сессии (thread-safe)"""
+def get_session(session_id: str) -> Tuple[YandexGPTHandler, threading.Lock]:
+    """
+    Получить или создать сессию (thread-safe): handler и лок для её запросов.
+    Сессия отмечается занятой; каждый вызов должен завершаться release_session() — в finally.
+    """
     with _handlers_lock:
-        if session_id in _handlers:
-            _handlers[session_id]["last_active"] = time.time()
-            return _handlers[session_id]["handler"]
+        info = _handlers.get(session_id)
+        if info is not None:
+            info["last_active"] = time.monotonic()
+            info["in_use"] += 1
+            _handlers.move_to_end(session_id)
+            return info["handler"], info["lock"]
         handler = YandexGPTHandler()
         # Подключаем диалоговый лог
         handler._dialogue_log_callback = lambda direction, content: _write_dialogue_log(session_id, direction, content)
-        _handlers[session_id] = {"handler": handler, "last_active": time.time()}
+        session_lock = threading.Lock()
+        _handlers[session_id] = {"handler": handler, "lock": session_lock, "in_use": 1, "last_active": time.monotonic()}
         logger.info("🆕 New session %s  (total sessions: %d)", session_id[:8], len(_handlers))
         _write_dialogue_log(session_id, "SYSTEM", f"New session created (model: {handler.model})")
-        return handler
+        # Лимит сессий: вытесняем самые давно неактивные из свободных
+        while len(_handlers) > MAX_SESSIONS:
+            old_sid = next((sid for sid, info in _handlers.items() if info["in_use"] == 0), None)
+            if old_sid is None:
+                logger.warning("🧹 MAX_SESSIONS=%d exceeded: all sessions are busy, nothing to evict", MAX_SESSIONS)
+                break
+            _close_handler(old_sid, _handlers.pop(old_sid)["handler"])
+            logger.info("🧹 Evicted session %s (MAX_SESSIONS=%d)", old_sid[:8], MAX_SESSIONS)
+        return handler, session_lock
+
+
+def release_session(session_id: str):
+    """Запрос закончил работу с сессией (парный вызов к get_session)"""
+    with _handlers_lock:
+        info = _handlers.get(session_id)
+        if info is not None:
+            info["in_use"] -= 1
+            # Длинный ход — тоже активность: считаем от его окончания
+            info["last_active"] = time.monotonic()
+            _handlers.move_to_end(session_id)
 
 
 def _cleanup_stale_sessions():
     """Удалить сессии, неактивные дольше SESSION_TTL_SECONDS"""
-    now = time.time()
+    now = time.monotonic()
+    removed = 0
     with _handlers_lock:
-        stale = [sid for sid, info in _handlers.items()
-                 if now - info["last_active"] > SESSION_TTL_SECONDS]
-        for sid in stale:
-            handler = _handlers[sid]["handler"]
-            try:
-                handler.close_sync()
-            except Exception:
-                logger.debug("close_sync failed for session %s", sid[:8], exc_info=True)
+        # _handlers упорядочен по активности — просроченные сессии только в начале,
+        # обходим их и останавливаемся на первой живой (без скана всех сессий)
+        while _handlers:
+            sid, info = next(iter(_handlers.items()))
+            if now - info["last_active"] <= SESSION_TTL_SECONDS:
+                break
+            if info["in_use"]:
+                # Запрос ещё идёт — сессия активна, переносим в конец очереди
+                info["last_active"] = now
+                _handlers.move_to_end(sid)
+                continue
             del _handlers[sid]
-        if stale:
-            logger.info("🧹 Cleaned up %d stale sessions (remaining: %d)", len(stale), len(_handlers))
+            _close_handler(sid, info["handler"])
+            removed += 1
+        if removed:
+            logger.info("🧹 Cleaned up %d stale sessions (remaining: %d)", removed, len(_handlers))
+
+
+def _session_cleanup_loop():
+    """Фоновая очистка сессий — не зависит от входящих запросов"""
+    while True:
+        time.sleep(SESSION_CLEANUP_INTERVAL_SECONDS)
+        try:
+            _cleanup_stale_sessions()
+        except Exception:
+            logger.exception("session cleanup failed")
+
+
+threading.Thread(target=_session_cleanup_loop, name="session-cleanup", daemon=True).start()
 
 
 # Путь к новому фронтенду (frontend/) — абсолютный путь для корректной работы send_from_directory
@@ -208,18 +370,11 @@ def favicon():
     """Чтобы не засорять логи 404-ками от браузера."""
     return ("", 204)
 
-_last_cleanup = [0.0]  # mutable container for nonlocal access
-
 @app.before_request
 def _log_request_start():
     g._req_start = time.perf_counter()
-    g.request_id = uuid.uuid4().hex[:8]
+    g.request_id = os.urandom(4).hex()  # 8 hex-символов, без объекта UUID
     logger.info("-> %s %s rid=%s ip=%s", request.method, request.path, g.request_id, request.remote_addr)
-    # Периодическая очистка устаревших сессий (каждые 5 минут)
-    now = time.time()
-    if now - _last_cleanup[0] > 300:
-        _last_cleanup[0] = now
-        _cleanup_stale_sessions()
 
 
 @app.after_request
@@ -258,19 +413,25 @@ def chat():
     if not message:
         return jsonify({'error': 'Empty message'}), 400
     
-    handler = get_handler(session_id)
+    handler, session_lock = get_session(session_id)
     
     try:
-        # Запускаем async функцию
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        response = loop.run_until_complete(handler.chat(message))
-        loop.close()
+        # Запускаем async функцию (запросы одной сессии — по очереди)
+        with session_lock:
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            try:
+                response = loop.run_until_complete(handler.chat(message))
+            finally:
+                # Пул соединений TourVisor привязан к этому loop'у — закрываем вместе с ним
+                _close_turn_loop(handler, loop)
         
         return jsonify({'response': response})
     except Exception as e:
         logger.exception("chat error session_id=%s", session_id)
         return jsonify({'error': str(e)}), 500
+    finally:
+        release_session(session_id)
 
 
 @app.route('/api/v1/chat', methods=['POST'])
@@ -287,7 +448,10 @@ def chat_v1():
     """
     data = request.json
     message = data.get('message', '')
-    conversation_id = data.get('conversation_id', str(uuid.uuid4()))
+    conversation_id = data.get('conversation_id')
+    if conversation_id is None:
+        # UUID генерируем только для нового диалога, а не на каждый запрос
+        conversation_id = str(uuid.uuid4())
 
     if not message:
         return jsonify({
@@ -300,23 +464,28 @@ def chat_v1():
     # conversation_id → session_id
     session_id = conversation_id
 
-    log(f"━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━", "INFO")
-    log(f"📨 [v1] Новое сообщение от {session_id[:8]}...", "MSG")
-    log(f"   └─ \"{message[:100]}{'...' if len(message) > 100 else ''}\"", "MSG")
+    logger.info("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+    logger.info("📨 [v1] Новое сообщение от %s...", session_id[:8])
+    logger.info("   └─ \"%s%s\"", message[:100], "..." if len(message) > 100 else "")
 
     _write_dialogue_log(session_id, "USER", message)
 
-    handler = get_handler(session_id)
+    handler, session_lock = get_session(session_id)
 
     try:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        reply = loop.run_until_complete(handler.chat(message))
-        loop.close()
+        # Запросы одной сессии — по очереди; tour_cards забираем под тем же локом
+        with session_lock:
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            try:
+                reply = loop.run_until_complete(handler.chat(message))
+            finally:
+                _close_turn_loop(handler, loop)
 
-        # Забираем накопленные tour_cards
-        tour_cards = list(handler._pending_tour_cards)
-        handler._pending_tour_cards = []
+            # Забираем накопленные tour_cards: handler всегда присваивает новый список,
+            # поэтому достаточно забрать ссылку — без копии
+            tour_cards = handler._pending_tour_cards
+            handler._pending_tour_cards = []
 
         _write_dialogue_log(session_id, "ASSISTANT", reply)
 
@@ -325,10 +494,10 @@ def chat_v1():
             cards_summary_lines = []
             for i, card in enumerate(tour_cards, 1):
                 cards_summary_lines.append(
-                    f"  {i}. {card.get('hotel_name', '?')} {'⭐' * card.get('hotel_stars', 0)}\n"
+                    f"  {i}. {card.get('hotel_name', '?')} {_stars_display(card.get('hotel_stars', 0))}\n"
                     f"     📍 {card.get('country', '')} / {card.get('resort', '')}\n"
-                    f"     💰 {card.get('price', '?'):,} ₽ {'(за чел.)' if card.get('price_per_person') else '(за тур)'}\n"
-                    f"     📅 {card.get('date_from', '?')} → {card.get('date_to', '?')} ({card.get('nights', '?')} ночей)\n"
+                    f"     💰 {_format_price(card.get('price', '?'))} ₽ {'(за чел.)' if card.get('price_per_person') else '(за тур)'}\n"
+                    f"     📅 {card.get('date_from', '?')} → {card.get('date_to', '?')} ({_format_nights(card.get('nights', '?'))})\n"
                     f"     🍽 {card.get('meal_description', card.get('food_type', '?'))}\n"
                     f"     🏨 {card.get('room_type', '?')}\n"
                     f"     ✈️ Из: {card.get('departure_city', '?')} | Перелёт: {'Да' if card.get('flight_included') else 'Нет'}\n"
@@ -338,7 +507,7 @@ def chat_v1():
             cards_text = f"Показано {len(tour_cards)} карточек:\n" + "\n".join(cards_summary_lines)
             _write_dialogue_log(session_id, "TOUR_CARDS", cards_text)
 
-        log(f"✅ [v1] Ответ: {len(reply)} символов, {len(tour_cards)} карточек", "OK")
+        logger.info("✅ [v1] Ответ: %d символов, %d карточек", len(reply), len(tour_cards))
 
         return jsonify({
             'reply': reply,
@@ -355,6 +524,19 @@ def chat_v1():
             'tour_cards': [],
             'conversation_id': conversation_id
         }), 500
+    finally:
+        release_session(session_id)
+
+
+# SSE: один энкодер на процесс; кириллица идёт как есть (UTF-8), без \uXXXX —
+# токен в 2-6 раз короче и не тратим время на экранирование
+_SSE_ENCODER = json.JSONEncoder(ensure_ascii=False)
+_SSE_PING = "data: " + _SSE_ENCODER.encode({'type': 'ping'}) + "\n\n"
+
+
+def _sse_event(event_type: str, content: str) -> str:
+    """Кадр SSE `data: {...}` для события стрима"""
+    return "data: " + _SSE_ENCODER.encode({'type': event_type, 'content': content}) + "\n\n"
 
 
 @app.route('/api/chat/stream', methods=['POST'])
@@ -364,20 +546,22 @@ def chat_stream():
     message = data.get('message', '')
     session_id = data.get('session_id', 'default')
     
-    log(f"━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━", "INFO")
-    log(f"📨 Новое сообщение от {session_id[:8]}...", "MSG")
-    log(f"   └─ \"{message[:100]}{'...' if len(message) > 100 else ''}\"", "MSG")
+    logger.info("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+    logger.info("📨 Новое сообщение от %s...", session_id[:8])
+    logger.info("   └─ \"%s%s\"", message[:100], "..." if len(message) > 100 else "")
     
     # Логируем входящее сообщение пользователя
     _write_dialogue_log(session_id, "USER", message)
     
     if not message:
-        log("❌ Пустое сообщение!", "ERROR")
+        logger.error("❌ Пустое сообщение!")
         return jsonify({'error': 'Empty message'}), 400
     
-    handler = get_handler(session_id)
-    log(f"📊 Модель: {handler.model}", "INFO")
-    log(f"📊 История: {len(handler.input_list)} сообщений", "INFO")
+    handler, session_lock = get_session(session_id)
+    # Сессию отпускает поток run_chat; если стрим так и не начался — закрытие ответа
+    worker_started = [False]
+    logger.info("📊 Модель: %s", handler.model)
+    logger.info("📊 История: %d сообщений", len(handler.input_list))
     
     def generate():
         token_queue = queue.Queue()
@@ -409,28 +593,34 @@ def chat_stream():
         
         def run_chat():
             try:
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                log("🚀 Отправляю запрос в YandexGPT...", "INFO")
-                response = loop.run_until_complete(
-                    handler.chat_stream(message, on_token=on_token)
-                )
-                loop.close()
+                # Запросы одной сессии — по очереди
+                with session_lock:
+                    loop = asyncio.new_event_loop()
+                    asyncio.set_event_loop(loop)
+                    logger.info("🚀 Отправляю запрос в YandexGPT...")
+                    try:
+                        response = loop.run_until_complete(
+                            handler.chat_stream(message, on_token=on_token)
+                        )
+                    finally:
+                        _close_turn_loop(handler, loop)
                 result['response'] = response
-                log(f"✅ Ответ получен: {len(response)} символов, {token_count[0]} токенов", "OK")
-                log(f"   └─ \"{response[:150]}{'...' if len(response) > 150 else ''}\"", "OK")
+                logger.info("✅ Ответ получен: %d символов, %d токенов", len(response), token_count[0])
+                logger.info("   └─ \"%s%s\"", response[:150], "..." if len(response) > 150 else "")
                 # Логируем полный ответ ассистента
                 _write_dialogue_log(session_id, "ASSISTANT", response)
                 token_queue.put(('done', response))
             except Exception as e:
                 result['error'] = str(e)
                 logger.exception("stream chat error session_id=%s", session_id)
-                log(f"❌ ОШИБКА: {e}", "ERROR")
                 _write_dialogue_log(session_id, "ERROR", str(e))
                 token_queue.put(('error', str(e)))
+            finally:
+                release_session(session_id)
         
         # Запускаем в отдельном потоке
         thread = threading.Thread(target=run_chat)
+        worker_started[0] = True
         thread.start()
         
         # Стримим токены
@@ -439,20 +629,24 @@ def chat_stream():
                 event_type, data = token_queue.get(timeout=60)
                 
                 if event_type == 'token':
-                    yield f"data: {json.dumps({'type': 'token', 'content': data})}\n\n"
+                    yield _sse_event('token', data)
                 elif event_type == 'done':
-                    yield f"data: {json.dumps({'type': 'done', 'content': data})}\n\n"
+                    yield _sse_event('done', data)
                     break
                 elif event_type == 'error':
-                    yield f"data: {json.dumps({'type': 'error', 'content': data})}\n\n"
+                    yield _sse_event('error', data)
                     break
             except queue.Empty:
-                log("⏳ Таймаут ожидания...", "WARN")
-                yield f"data: {json.dumps({'type': 'ping'})}\n\n"
+                logger.warning("⏳ Таймаут ожидания...")
+                yield _SSE_PING
         
         thread.join()
     
-    return Response(
+    def release_if_not_started():
+        if not worker_started[0]:
+            release_session(session_id)
+    
+    response = Response(
         stream_with_context(generate()),
         mimetype='text/event-stream',
         headers={
@@ -460,6 +654,8 @@ def chat_stream():
             'X-Accel-Buffering': 'no'
         }
     )
+    response.call_on_close(release_if_not_started)
+    return response
 
 
 @app.route('/api/reset', methods=['POST'])
@@ -469,10 +665,14 @@ def reset():
     session_id = data.get('session_id', 'default')
     
     with _handlers_lock:
-        if session_id in _handlers:
-            _handlers[session_id]["handler"].reset()
-            log(f"🔄 Сессия {session_id[:8]}... сброшена", "WARN")
-            _write_dialogue_log(session_id, "SYSTEM", "=== SESSION RESET ===")
+        info = _handlers.get(session_id)
+    
+    if info is not None:
+        # Сброс ждёт завершения текущего запроса этой сессии (глобальный лок уже отпущен)
+        with info["lock"]:
+            info["handler"].reset()
+        logger.warning("🔄 Сессия %s... сброшена", session_id[:8])
+        _write_dialogue_log(session_id, "SYSTEM", "=== SESSION RESET ===")
     
     return jsonify({'status': 'ok'})
 
@@ -480,35 +680,41 @@ def reset():
 @app.route('/api/status')
 def status():
     """Статус сервера"""
-    with _handlers_lock:
-        session_count = len(_handlers)
+    # Без _handlers_lock: len() атомарен, а health-пробы не должны ждать
+    # создания/очистки сессий
     return jsonify({
         'status': 'running',
-        'sessions': session_count
+        'sessions': len(_handlers)
     })
 
 
+# Метрики handler'ов, суммируемые по всем сессиям
+_AGGREGATED_METRICS = (
+    "promised_search_detections",
+    "cascade_incomplete_detections",
+    "dateto_corrections",
+    "total_searches",
+    "total_messages",
+)
+
+
 @app.route('/api/metrics')
 def get_metrics():
     """
     Возвращает агрегированные метрики по всем активным сессиям.
     Используется для мониторинга качества работы AI-ассистента.
+    
+    dateto_corrections считает исправления dateto только в вызовах search_tours,
+    которые ушли в поиск: вызовы, заблокированные проверками (каскад, курорт и т.п.),
+    до нормализации дат не доходят и в метрику не попадают.
     """
     with _handlers_lock:
-        aggregated = {
-            "total_sessions": len(_handlers),
-            "promised_search_detections": 0,
-            "cascade_incomplete_detections": 0,
-            "dateto_corrections": 0,
-            "total_searches": 0,
-            "total_messages": 0,
-        }
+        aggregated = {"total_sessions": len(_handlers)}
+        aggregated.update(dict.fromkeys(_AGGREGATED_METRICS, 0))
         
         for session_data in _handlers.values():
-            handler = session_data["handler"]
-            metrics = handler.get_metrics()
-            for key in ["promised_search_detections", "cascade_incomplete_detections", 
-                        "dateto_corrections", "total_searches", "total_messages"]:
+            metrics = session_data["handler"].get_metrics()
+            for key in _AGGREGATED_METRICS:
                 aggregated[key] += metrics.get(key, 0)
         
         return jsonify(aggregated)
@@ -518,9 +724,7 @@ if __name__ == '__main__':
     import socket
     from werkzeug.serving import run_simple
 
-    from dotenv import load_dotenv
-    load_dotenv()
-    
+    # .env уже загружен при импорте yandex_handler → tourvisor_client
     model = os.getenv("YANDEX_MODEL", "yandexgpt")
     folder = os.getenv("YANDEX_FOLDER_ID", "???")
     
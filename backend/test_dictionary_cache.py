@@ -0,0 +1,295 @@
+"""
+Тесты кэша справочников TourVisor (_request_dictionary): объединение одновременных
+промахов в один запрос, заполнение кэша под локом, дисковый кэш (TOURVISOR_CACHE_DIR)
+Запуск: python -m pytest -q test_dictionary_cache.py
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+
+import pytest
+
+import tourvisor_client
+from tourvisor_client import TourVisorClient
+
+
+MEALS = {"lists": {"meals": {"meal": [{"id": 1, "name": "BB"}]}}}
+MEALS_KEY = (("type", "meal"),)
+
+
+class _FakeRequest:
+    """Заглушка TourVisorClient._request со счётчиком запросов"""
+
+    def __init__(self, delay=0.05, error=None):
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+        self.calls_by_type = {}
+        self._lock = threading.Lock()
+
+    async def __call__(self, endpoint, params):
+        with self._lock:
+            self.calls += 1
+            self.calls_by_type[params["type"]] = self.calls_by_type.get(params["type"], 0) + 1
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return MEALS
+
+
+@pytest.fixture(autouse=True)
+def clean_cache(monkeypatch):
+    monkeypatch.setattr(tourvisor_client, "DICTIONARY_CACHE_TTL_SECONDS", 3600)
+    monkeypatch.setattr(tourvisor_client, "DICTIONARY_DISK_CACHE_DIR", "")
+    tourvisor_client._dictionary_cache.clear()
+    tourvisor_client._dictionary_inflight.clear()
+    yield
+    tourvisor_client._dictionary_cache.clear()
+    tourvisor_client._dictionary_inflight.clear()
+
+
+def _client(fake):
+    client = TourVisorClient()
+    client._request = fake
+    return client
+
+
+def test_concurrent_misses_share_one_request():
+    fake = _FakeRequest()
+    client = _client(fake)
+
+    async def main():
+        return await asyncio.gather(*(client.get_meals() for _ in range(5)))
+
+    results = asyncio.run(main())
+
+    assert fake.calls == 1
+    assert all(r == MEALS["lists"]["meals"]["meal"] for r in results)
+    assert not tourvisor_client._dictionary_inflight
+
+
+def test_cache_hit_skips_request():
+    fake = _FakeRequest()
+    client = _client(fake)
+
+    asyncio.run(client.get_meals())
+    asyncio.run(client.get_meals())
+
+    assert fake.calls == 1
+
+
+def test_waiters_in_other_threads_share_one_request():
+    fake = _FakeRequest(delay=0.2)
+    results = []
+
+    def session():
+        # Как в app.py: у каждой сессии свой поток и свой event loop
+        results.append(asyncio.run(_client(fake).get_meals()))
+
+    threads = [threading.Thread(target=session) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert fake.calls == 1
+    assert len(results) == 4
+
+
+def test_leader_error_propagates_to_waiters_and_is_not_cached():
+    fake = _FakeRequest(error=tourvisor_client.TourVisorAPIError("boom"))
+    client = _client(fake)
+
+    async def main():
+        return await asyncio.gather(*(client.get_meals() for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(main())
+
+    assert fake.calls == 1
+    assert all(isinstance(r, tourvisor_client.TourVisorAPIError) for r in results)
+    assert not tourvisor_client._dictionary_inflight
+    assert not tourvisor_client._dictionary_cache
+
+    fake.error = None
+    asyncio.run(client.get_meals())
+    assert fake.calls == 2
+
+
+def test_cancelled_leader_lets_waiter_fetch_itself():
+    fake = _FakeRequest()
+    client = _client(fake)
+
+    async def main():
+        leader = asyncio.create_task(client.get_meals())
+        await asyncio.sleep(0)  # лидер зарегистрировал запрос «в полёте»
+        waiter = asyncio.create_task(client.get_meals())
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await waiter
+
+    assert asyncio.run(main()) == MEALS["lists"]["meals"]["meal"]
+    assert fake.calls == 2
+    assert not tourvisor_client._dictionary_inflight
+
+
+def test_cancelled_waiter_does_not_cancel_leader():
+    fake = _FakeRequest()
+    client = _client(fake)
+
+    async def main():
+        leader = asyncio.create_task(client.get_meals())
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(client.get_meals())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        return await leader
+
+    assert asyncio.run(main()) == MEALS["lists"]["meals"]["meal"]
+    assert fake.calls == 1
+    assert tourvisor_client._dictionary_cache
+
+
+def test_many_threads_many_keys_one_request_per_key():
+    fake = _FakeRequest(delay=0.1)
+    barrier = threading.Barrier(8)
+
+    def session():
+        client = _client(fake)
+
+        async def main():
+            await asyncio.gather(client.get_meals(), client.get_stars(), client.get_departures())
+
+        barrier.wait()
+        asyncio.run(main())
+
+    threads = [threading.Thread(target=session) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert fake.calls_by_type == {"meal": 1, "stars": 1, "departure": 1}
+    assert len(tourvisor_client._dictionary_cache) == 3
+    assert not tourvisor_client._dictionary_inflight
+
+
+def test_expired_entry_is_refetched():
+    fake = _FakeRequest()
+    client = _client(fake)
+    asyncio.run(client.get_meals())
+
+    _, data = tourvisor_client._dictionary_cache[MEALS_KEY]
+    tourvisor_client._dictionary_cache[MEALS_KEY] = (time.monotonic() - 1, data)
+    asyncio.run(client.get_meals())
+
+    assert fake.calls == 2
+    assert tourvisor_client._dictionary_cache[MEALS_KEY][0] > time.monotonic()
+
+
+def test_key_is_always_cached_or_in_flight():
+    # Запрос «в полёте» убирается в той же критической секции, где пишется кэш:
+    # под локом никто не должен увидеть ключ ни там, ни там (иначе — повторный запрос)
+    fake = _FakeRequest(delay=0.1)
+    cache, inflight = tourvisor_client._dictionary_cache, tourvisor_client._dictionary_inflight
+    stop = threading.Event()
+    states = []
+
+    def watch():
+        while not stop.is_set():
+            with tourvisor_client._dictionary_lock:
+                states.append(MEALS_KEY in cache or MEALS_KEY in inflight)
+
+    watcher = threading.Thread(target=watch)
+    watcher.start()
+    try:
+        asyncio.run(_client(fake).get_meals())
+        time.sleep(0.05)
+    finally:
+        stop.set()
+        watcher.join()
+
+    first_seen = states.index(True)
+    assert all(states[first_seen:])
+    assert fake.calls == 1
+
+
+@pytest.fixture
+def disk_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(tourvisor_client, "DICTIONARY_DISK_CACHE_DIR", str(tmp_path))
+    return tmp_path
+
+
+def _age(path, seconds):
+    mtime = time.time() - seconds
+    os.utime(path, (mtime, mtime))
+
+
+def test_disk_cache_survives_process_cache(disk_cache):
+    fake = _FakeRequest()
+    asyncio.run(_client(fake).get_meals())
+
+    files = list(disk_cache.iterdir())
+    assert [f.name for f in files] == [os.path.basename(tourvisor_client._disk_cache_path(MEALS_KEY))]
+    assert json.loads(files[0].read_text(encoding="utf-8")) == MEALS
+
+    # «Новый процесс»: кэш в памяти пуст, справочник читается с диска
+    tourvisor_client._dictionary_cache.clear()
+    _age(files[0], 1000)
+    assert asyncio.run(_client(fake).get_meals()) == MEALS["lists"]["meals"]["meal"]
+    assert fake.calls == 1
+
+    # Срок в памяти — остаток TTL по возрасту файла
+    expires_at = tourvisor_client._dictionary_cache[MEALS_KEY][0]
+    assert expires_at - time.monotonic() == pytest.approx(3600 - 1000, abs=5)
+
+
+def test_expired_disk_entry_is_refetched(disk_cache):
+    fake = _FakeRequest()
+    asyncio.run(_client(fake).get_meals())
+    path = tourvisor_client._disk_cache_path(MEALS_KEY)
+
+    tourvisor_client._dictionary_cache.clear()
+    _age(path, 3600 + 1)
+    asyncio.run(_client(fake).get_meals())
+
+    assert fake.calls == 2
+    assert time.time() - os.path.getmtime(path) < 60  # файл перезаписан
+
+
+def test_corrupt_disk_entry_is_refetched(disk_cache):
+    path = tourvisor_client._disk_cache_path(MEALS_KEY)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('{"lists": ')
+    fake = _FakeRequest()
+
+    assert asyncio.run(_client(fake).get_meals()) == MEALS["lists"]["meals"]["meal"]
+    assert fake.calls == 1
+    with open(path, encoding="utf-8") as f:
+        assert json.load(f) == MEALS
+
+
+def test_failed_write_leaves_no_partial_files(disk_cache, monkeypatch):
+    def fail_replace(src, dst):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(tourvisor_client.os, "replace", fail_replace)
+    fake = _FakeRequest()
+
+    # Ошибка записи не ломает запрос справочника
+    assert asyncio.run(_client(fake).get_meals()) == MEALS["lists"]["meals"]["meal"]
+    assert list(disk_cache.iterdir()) == []
+
+
+def test_disk_cache_disabled_without_dir(tmp_path):
+    fake = _FakeRequest()
+    asyncio.run(_client(fake).get_meals())
+
+    assert tourvisor_client._read_disk_cache(MEALS_KEY) is None
+    assert list(tmp_path.iterdir()) == []
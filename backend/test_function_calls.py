@@ -0,0 +1,76 @@
+"""
+Тесты выполнения вызовов функций из одного ответа модели (_execute_function_calls)
+Запуск: python -m pytest -q test_function_calls.py
+"""
+
+import asyncio
+
+from yandex_handler import YandexGPTHandler, _PARALLEL_SAFE_FUNCTIONS
+
+
+class _Recorder:
+    """Заглушка _execute_function: пишет начало/конец каждого вызова"""
+
+    def __init__(self):
+        self.events = []
+
+    async def __call__(self, name, arguments, call_id):
+        self.events.append(("start", call_id))
+        await asyncio.sleep(0.01)
+        self.events.append(("end", call_id))
+        return {"type": "function_call_output", "call_id": call_id, "output": name}
+
+
+def _run(calls):
+    handler = YandexGPTHandler.__new__(YandexGPTHandler)  # без OpenAI-клиента и TourVisor
+    recorder = _Recorder()
+    handler._execute_function = recorder
+    results = asyncio.run(handler._execute_function_calls(calls))
+    return results, recorder.events
+
+
+def test_safe_calls_run_concurrently():
+    calls = [("get_hotel_info", "{}", "a"), ("get_dictionaries", "{}", "b"), ("get_current_date", "{}", "c")]
+    results, events = _run(calls)
+
+    # Все три стартуют до того, как первый закончится
+    assert events[:3] == [("start", "a"), ("start", "b"), ("start", "c")]
+    assert [r["call_id"] for r in results] == ["a", "b", "c"]
+
+
+def test_unsafe_calls_run_in_order():
+    calls = [("search_tours", "{}", "a"), ("get_search_status", "{}", "b"), ("get_search_results", "{}", "c")]
+    assert not {name for name, _, _ in calls} & _PARALLEL_SAFE_FUNCTIONS
+    results, events = _run(calls)
+
+    assert events == [
+        ("start", "a"), ("end", "a"),
+        ("start", "b"), ("end", "b"),
+        ("start", "c"), ("end", "c"),
+    ]
+    assert [r["call_id"] for r in results] == ["a", "b", "c"]
+
+
+def test_unsafe_call_waits_for_preceding_batch():
+    calls = [
+        ("get_dictionaries", "{}", "a"),
+        ("get_hotel_info", "{}", "b"),
+        ("search_tours", "{}", "c"),
+        ("get_tour_details", "{}", "d"),
+        ("get_current_date", "{}", "e"),
+    ]
+    results, events = _run(calls)
+
+    position = {event: i for i, event in enumerate(events)}
+    # Пакет до search_tours полностью завершён до его старта
+    assert position[("start", "c")] > max(position[("end", "a")], position[("end", "b")])
+    # Пакет после search_tours стартует только после его завершения — и параллельно
+    assert min(position[("start", "d")], position[("start", "e")]) > position[("end", "c")]
+    assert position[("start", "e")] < position[("end", "d")]
+    # Результаты — в исходном порядке вызовов
+    assert [r["call_id"] for r in results] == ["a", "b", "c", "d", "e"]
+
+
+def test_empty_calls():
+    results, events = _run([])
+    assert results == [] and events == []
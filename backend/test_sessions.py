@@ -0,0 +1,165 @@
+"""
+Тесты хранилища сессий app.py: лимит MAX_SESSIONS, занятые сессии, очистка по TTL,
+последовательная обработка запросов одной сессии
+Запуск: python -m pytest -q test_sessions.py
+"""
+
+import asyncio
+import os
+import threading
+import time
+
+os.environ.setdefault("YANDEX_API_KEY", "test")
+os.environ.setdefault("YANDEX_FOLDER_ID", "test")
+
+import pytest
+
+import app
+
+
+class _Concurrency:
+    """Счётчик одновременно выполняемых ходов и его максимум"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.active = 0
+        self.peak = 0
+
+    def __enter__(self):
+        with self._lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+
+    def __exit__(self, *exc):
+        with self._lock:
+            self.active -= 1
+
+
+class _StubTourVisor:
+    async def close(self):
+        pass
+
+
+class _StubHandler:
+    """Заглушка YandexGPTHandler — без сети и OpenAI-клиента"""
+
+    model = "stub"
+    all_turns = _Concurrency()
+
+    def __init__(self):
+        self.tourvisor = _StubTourVisor()
+        self.closed = False
+        self.turns = _Concurrency()
+
+    async def chat(self, message):
+        with self.turns, self.all_turns:
+            await asyncio.sleep(0.2)
+        return message
+
+    def close_sync(self):
+        self.closed = True
+
+
+@pytest.fixture(autouse=True)
+def sessions(monkeypatch):
+    monkeypatch.setattr(app, "YandexGPTHandler", _StubHandler)
+    monkeypatch.setattr(app, "_write_dialogue_log", lambda *args: None)
+    monkeypatch.setattr(app, "MAX_SESSIONS", 2)
+    with app._handlers_lock:
+        saved = app._handlers.copy()
+        app._handlers.clear()
+    yield app._handlers
+    with app._handlers_lock:
+        app._handlers.clear()
+        app._handlers.update(saved)
+
+
+def _open(session_id):
+    """Сессия, отработавшая один запрос (свободна)"""
+    handler, _ = app.get_session(session_id)
+    app.release_session(session_id)
+    return handler
+
+
+def test_get_session_marks_in_use(sessions):
+    app.get_session("a")
+    app.get_session("a")
+    assert sessions["a"]["in_use"] == 2
+    app.release_session("a")
+    app.release_session("a")
+    assert sessions["a"]["in_use"] == 0
+
+
+def test_evicts_least_recently_used(sessions):
+    first = _open("a")
+    _open("b")
+    _open("a")  # «a» снова активна — самая давняя теперь «b»
+    _open("c")
+
+    assert list(sessions) == ["a", "c"]
+    assert not first.closed
+
+
+def test_busy_session_is_not_evicted(sessions):
+    busy, _ = app.get_session("a")  # запрос ещё идёт
+    _open("b")
+    _open("c")
+
+    assert list(sessions) == ["a", "c"]
+    assert not busy.closed
+    app.release_session("a")
+
+
+def test_all_busy_exceeds_limit(sessions):
+    handlers = [app.get_session(sid)[0] for sid in ("a", "b", "c")]
+
+    # Вытеснять некого — лимит временно превышен, ни одна занятая сессия не закрыта
+    assert list(sessions) == ["a", "b", "c"]
+    assert not any(h.closed for h in handlers)
+
+    for sid in ("a", "b", "c"):
+        app.release_session(sid)
+    _open("d")
+    assert list(sessions) == ["c", "d"]
+
+
+def test_cleanup_skips_busy_sessions(sessions):
+    idle = _open("idle")
+    busy, _ = app.get_session("busy")
+    stale = time.monotonic() - app.SESSION_TTL_SECONDS - 1
+    for info in sessions.values():
+        info["last_active"] = stale
+
+    app._cleanup_stale_sessions()
+
+    assert list(sessions) == ["busy"]
+    assert idle.closed and not busy.closed
+    app.release_session("busy")
+
+
+def _post_concurrently(session_ids):
+    def post(session_id):
+        client = app.app.test_client()
+        response = client.post("/api/chat", json={"message": "привет", "session_id": session_id})
+        assert response.status_code == 200
+
+    threads = [threading.Thread(target=post, args=(sid,)) for sid in session_ids]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def test_turns_of_one_session_are_serialized(sessions, monkeypatch):
+    monkeypatch.setattr(_StubHandler, "all_turns", _Concurrency())
+    _post_concurrently(["a", "a", "a"])
+
+    assert sessions["a"]["handler"].turns.peak == 1
+    assert sessions["a"]["in_use"] == 0
+
+
+def test_different_sessions_run_in_parallel(sessions, monkeypatch):
+    monkeypatch.setattr(_StubHandler, "all_turns", _Concurrency())
+    _post_concurrently(["a", "b"])
+
+    assert _StubHandler.all_turns.peak == 2
@@ -6,7 +6,11 @@ TourVisor API Client
 import os
 import json
 import asyncio
+import concurrent.futures
+import hashlib
 import logging
+import random
+import threading
 import time
 from typing import Optional, Dict, Any, List
 from datetime import datetime, timedelta
@@ -49,6 +53,94 @@ class NoResultsError(TourVisorError):
         self.filters_hint = filters_hint  # Подсказка какие фильтры смягчить
 
 
+# ==================== КЭШ СПРАВОЧНИКОВ ====================
+
+# Справочники list.php (города вылета, страны, курорты, питание...) меняются редко,
+# а модель запрашивает их почти в каждом диалоге. Кэш общий на процесс:
+# каждая сессия создаёт свой TourVisorClient, поэтому кэш живёт на уровне модуля.
+# TOURVISOR_DICT_CACHE_TTL=0 — отключить кэш.
+DICTIONARY_CACHE_TTL_SECONDS = int(os.getenv("TOURVISOR_DICT_CACHE_TTL", str(6 * 60 * 60)))
+_dictionary_cache: Dict[tuple, tuple] = {}  # (параметры запроса) → (expires_at, data)
+# Запросы справочников «в полёте»: параллельные промахи кэша по одному ключу ждут первый
+# запрос, а не идут в сеть каждый. concurrent.futures.Future — потому что сессии
+# работают в разных потоках, каждая со своим event loop.
+_dictionary_inflight: Dict[tuple, concurrent.futures.Future] = {}
+_dictionary_lock = threading.Lock()  # защищает _dictionary_cache и _dictionary_inflight
+
+# Дисковый кэш справочников (опционально): переживает перезапуск процесса,
+# чтобы новый воркер не перезапрашивал справочники у TourVisor. Срок — тот же TTL по mtime файла.
+# TOURVISOR_CACHE_DIR не задан — только кэш в памяти.
+DICTIONARY_DISK_CACHE_DIR = os.getenv("TOURVISOR_CACHE_DIR", "")
+
+
+def _disk_cache_path(key: tuple) -> str:
+    digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+    return os.path.join(DICTIONARY_DISK_CACHE_DIR, f"list_{digest}.json")
+
+
+def _read_disk_cache(key: tuple) -> Optional[tuple]:
+    """Справочник с диска → (data, возраст в секундах) или None (нет/просрочен/битый)"""
+    if not DICTIONARY_DISK_CACHE_DIR or DICTIONARY_CACHE_TTL_SECONDS <= 0:
+        return None
+    path = _disk_cache_path(key)
+    try:
+        age = time.time() - os.path.getmtime(path)
+        if age >= DICTIONARY_CACHE_TTL_SECONDS:
+            return None
+        with open(path, encoding="utf-8") as f:
+            return json.load(f), max(age, 0.0)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_disk_cache(key: tuple, data: Dict):
+    """Атомарная запись справочника на диск (tmp + os.replace); ошибки не пробрасываем"""
+    if not DICTIONARY_DISK_CACHE_DIR or DICTIONARY_CACHE_TTL_SECONDS <= 0:
+        return
+    path = _disk_cache_path(key)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(DICTIONARY_DISK_CACHE_DIR, exist_ok=True)
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.warning("🌐 TOURVISOR disk cache write failed: %s", e)
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+
+# ==================== ОПРОС СТАТУСА ПОИСКА ====================
+
+# По документации TourVisor результаты появляются не раньше чем через 3–5 с после search.php,
+# дальше статус опрашивают раз в 2 с. Частые опросы не ускоряют поиск, а только нагружают API.
+SEARCH_POLL_INITIAL_DELAY = 3.0   # пауза от запуска поиска до первого опроса статуса, сек
+SEARCH_POLL_INTERVAL = 2.0        # базовый интервал опроса, сек
+SEARCH_POLL_MIN_DELAY = 1.0       # нижняя граница паузы при любых настройках
+SEARCH_POLL_BACKOFF = 1.25        # рост паузы для долгих (GDS) поисков — до max_delay
+SEARCH_POLL_JITTER = 0.1          # ±10% — чтобы параллельные сессии не опрашивали синхронно
+
+
+def next_poll_delay(attempt: int, max_delay: float = SEARCH_POLL_INTERVAL) -> float:
+    """
+    Пауза перед следующим опросом статуса: от SEARCH_POLL_INTERVAL с ростом до max_delay.
+    attempt — номер уже выполненного опроса (с 0). Не меньше SEARCH_POLL_MIN_DELAY.
+    """
+    delay = min(max_delay, SEARCH_POLL_INTERVAL * SEARCH_POLL_BACKOFF ** attempt)
+    delay *= random.uniform(1 - SEARCH_POLL_JITTER, 1 + SEARCH_POLL_JITTER)
+    return max(SEARCH_POLL_MIN_DELAY, delay)
+
+
+# ==================== HTTP ====================
+
+# Один ход диалога делает десятки запросов к одному хосту (list.php, search.php,
+# result.php, hotel.php) — держим keep-alive соединения, а не открываем TLS заново.
+HTTP_TIMEOUT = httpx.Timeout(30.0, connect=10.0)
+HTTP_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=30.0)
+
+
 class TourVisorClient:
     """Асинхронный клиент TourVisor API"""
     
@@ -56,6 +148,21 @@ class TourVisorClient:
         self.base_url = os.getenv("TOURVISOR_BASE_URL", "https://tourvisor.ru/xml")
         self.auth_login = os.getenv("TOURVISOR_AUTH_LOGIN")
         self.auth_pass = os.getenv("TOURVISOR_AUTH_PASS")
+        self._http: Optional[httpx.AsyncClient] = None
+        self._http_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._search_started_at: Dict[str, float] = {}  # requestid → time.monotonic() запуска
+    
+    def _get_http(self) -> httpx.AsyncClient:
+        """
+        Общий httpx.AsyncClient (пул соединений) для текущего event loop.
+        Flask создаёт новый loop на каждый запрос, а соединения пула привязаны к loop'у,
+        поэтому при смене loop'а клиент пересоздаётся (иначе — Event loop is closed).
+        """
+        loop = asyncio.get_running_loop()
+        if self._http is None or self._http_loop is not loop or self._http.is_closed:
+            self._http = httpx.AsyncClient(timeout=HTTP_TIMEOUT, limits=HTTP_LIMITS)
+            self._http_loop = loop
+        return self._http
     
     async def _request(self, endpoint: str, params: Dict[str, Any] = None) -> Dict:
         """
@@ -81,15 +188,13 @@ class TourVisorClient:
         logger.info("🌐 TOURVISOR >> %s  params=%s", endpoint, safe_params)
         t0 = time.perf_counter()
         
-        # Создаём новый клиент для каждого запроса (избегаем Event loop is closed)
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.get(url, params=params)
-                elapsed_ms = int((time.perf_counter() - t0) * 1000)
-                logger.info("🌐 TOURVISOR << %s  HTTP %s  %dms  size=%d bytes",
-                            endpoint, response.status_code, elapsed_ms, len(response.content))
-                response.raise_for_status()
-                data = response.json()
+            response = await self._get_http().get(url, params=params)
+            elapsed_ms = int((time.perf_counter() - t0) * 1000)
+            logger.info("🌐 TOURVISOR << %s  HTTP %s  %dms  size=%d bytes",
+                        endpoint, response.status_code, elapsed_ms, len(response.content))
+            response.raise_for_status()
+            data = response.json()
         except httpx.HTTPStatusError as e:
             elapsed_ms = int((time.perf_counter() - t0) * 1000)
             logger.error("🌐 TOURVISOR !! %s  HTTP %s  %dms  error=%s",
@@ -101,11 +206,12 @@ class TourVisorClient:
                          endpoint, elapsed_ms, str(e)[:200])
             raise
         
-        # Логируем ключевые поля ответа
-        preview = json.dumps(data, ensure_ascii=False, default=str)
-        if len(preview) > 500:
-            preview = preview[:500] + "…"
-        logger.debug("🌐 TOURVISOR << %s  body=%s", endpoint, preview)
+        # Логируем тело ответа (сериализация result.php дорогая — только при DEBUG)
+        if logger.isEnabledFor(logging.DEBUG):
+            preview = json.dumps(data, ensure_ascii=False, default=str)
+            if len(preview) > 500:
+                preview = preview[:500] + "…"
+            logger.debug("🌐 TOURVISOR << %s  body=%s", endpoint, preview)
         
         # Проверяем на ошибки API (HTTP 200, но есть errormessage)
         self._check_api_error(data, endpoint)
@@ -120,86 +226,143 @@ class TourVisorClient:
         - "Wrong (obsolete) TourID." — tourid истёк
         - "no search results" в status.state — requestid не найден
         """
+        # Все проверки смотрят в data["data"] — достаём один раз
+        inner = data.get("data")
+        if not isinstance(inner, dict):
+            return
+        
         # Проверка на errormessage (например, для actualize.php)
-        if "data" in data:
-            inner = data["data"]
-            if isinstance(inner, dict):
-                error_msg = inner.get("errormessage")
-                success = inner.get("success")
-                
-                if error_msg:
-                    logger.warning("🌐 TOURVISOR API ERROR [%s]: %s", endpoint, error_msg)
-                    # Специфичные ошибки
-                    if "TourID" in error_msg or "tourid" in error_msg.lower():
-                        raise TourIdExpiredError(error_msg, data)
-                    raise TourVisorAPIError(error_msg, data)
-                
-                if success == 0:
-                    logger.warning("🌐 TOURVISOR API ERROR [%s]: success=0", endpoint)
-                    raise TourVisorAPIError("Операция не выполнена (success=0)", data)
+        error_msg = inner.get("errormessage")
+        if error_msg:
+            logger.warning("🌐 TOURVISOR API ERROR [%s]: %s", endpoint, error_msg)
+            # Специфичные ошибки
+            if "TourID" in error_msg or "tourid" in error_msg.lower():
+                raise TourIdExpiredError(error_msg, data)
+            raise TourVisorAPIError(error_msg, data)
+        
+        if inner.get("success") == 0:
+            logger.warning("🌐 TOURVISOR API ERROR [%s]: success=0", endpoint)
+            raise TourVisorAPIError("Операция не выполнена (success=0)", data)
         
         # Проверка на "no search results" (для result.php)
         if endpoint == "result.php":
-            status = data.get("data", {}).get("status", {})
+            status = inner.get("status", {})
             if status.get("state") == "no search results":
                 logger.warning("🌐 TOURVISOR API [%s]: no search results (requestid invalid)", endpoint)
                 raise SearchNotFoundError("Поиск не найден (requestid недействителен)", data)
     
     # ==================== СПРАВОЧНИКИ ====================
     
+    async def _request_dictionary(self, params: Dict[str, Any]) -> Dict:
+        """
+        Запрос справочника list.php через кэш процесса (TTL — DICTIONARY_CACHE_TTL_SECONDS)
+        и, если задан TOURVISOR_CACHE_DIR, дисковый кэш.
+        Ключ кэша — параметры запроса без авторизации. Одновременные промахи по одному
+        ключу (в т.ч. из разных потоков) объединяются в один HTTP-запрос.
+        
+        Возвращаемый объект общий для всех сессий и потоков (тот же, что лежит в кэше) —
+        только для чтения: изменять его или вложенные списки нельзя, при необходимости копируйте.
+        """
+        key = tuple(sorted(params.items()))
+        now = time.monotonic()
+        # Проверка кэша и регистрация запроса «в полёте» — атомарно: иначе поток,
+        # промахнувшийся по кэшу в момент завершения чужого запроса, повторил бы его
+        with _dictionary_lock:
+            cached = _dictionary_cache.get(key)
+            if cached is None or cached[0] <= now:
+                flight = concurrent.futures.Future()
+                leader = _dictionary_inflight.setdefault(key, flight)
+        if cached is not None and cached[0] > now:
+            logger.debug("🌐 TOURVISOR CACHE HIT list.php  params=%s", params)
+            return cached[1]
+        
+        if leader is not flight:
+            logger.debug("🌐 TOURVISOR CACHE WAIT list.php  params=%s", params)
+            # shield — отмена ожидающего не должна отменять общий запрос
+            data = await asyncio.shield(asyncio.wrap_future(leader))
+            if data is not None:
+                return data
+            # Первый запрос прерван (отмена) — запрашиваем сами
+            return await self._request("list.php", params)
+        
+        try:
+            disk = _read_disk_cache(key)
+            if disk is not None:
+                data, age = disk
+                logger.debug("🌐 TOURVISOR DISK CACHE HIT list.php  params=%s  age=%ds", params, age)
+            else:
+                data = await self._request("list.php", params)
+                age = 0.0
+                _write_disk_cache(key, data)
+        except BaseException as e:
+            with _dictionary_lock:
+                _dictionary_inflight.pop(key, None)
+            if isinstance(e, Exception):
+                flight.set_exception(e)
+            else:
+                flight.set_result(None)
+            raise
+        
+        with _dictionary_lock:
+            if DICTIONARY_CACHE_TTL_SECONDS > 0:
+                _dictionary_cache[key] = (now + DICTIONARY_CACHE_TTL_SECONDS - age, data)
+            _dictionary_inflight.pop(key, None)
+        flight.set_result(data)
+        return data
+    
     async def get_departures(self) -> List[Dict]:
-        """Получить список городов вылета"""
-        data = await self._request("list.php", {"type": "departure"})
+        """Получить список городов вылета (общий кэшированный список — только для чтения)"""
+        data = await self._request_dictionary({"type": "departure"})
         departures = data.get("lists", {}).get("departures", {}).get("departure", [])
         return departures if isinstance(departures, list) else [departures]
     
     async def get_countries(self, departure_id: Optional[int] = None) -> List[Dict]:
-        """Получить список стран (опционально: с вылетами из города)"""
+        """Получить список стран (опционально: с вылетами из города) (общий кэшированный список — только для чтения)"""
         params = {"type": "country"}
         if departure_id:
             params["cndep"] = departure_id
-        data = await self._request("list.php", params)
+        data = await self._request_dictionary(params)
         countries = data.get("lists", {}).get("countries", {}).get("country", [])
         return countries if isinstance(countries, list) else [countries]
     
     async def get_regions(self, country_id: int) -> List[Dict]:
-        """Получить курорты страны"""
-        data = await self._request("list.php", {"type": "region", "regcountry": country_id})
+        """Получить курорты страны (общий кэшированный список — только для чтения)"""
+        data = await self._request_dictionary({"type": "region", "regcountry": country_id})
         regions = data.get("lists", {}).get("regions", {}).get("region", [])
         return regions if isinstance(regions, list) else [regions]
     
     async def get_subregions(self, country_id: int) -> List[Dict]:
-        """Получить районы курортов страны"""
-        data = await self._request("list.php", {"type": "subregion", "regcountry": country_id})
+        """Получить районы курортов страны (общий кэшированный список — только для чтения)"""
+        data = await self._request_dictionary({"type": "subregion", "regcountry": country_id})
         subregions = data.get("lists", {}).get("subregions", {}).get("subregion", [])
         return subregions if isinstance(subregions, list) else [subregions]
     
     async def get_meals(self) -> List[Dict]:
-        """Получить типы питания"""
-        data = await self._request("list.php", {"type": "meal"})
+        """Получить типы питания (общий кэшированный список — только для чтения)"""
+        data = await self._request_dictionary({"type": "meal"})
         meals = data.get("lists", {}).get("meals", {}).get("meal", [])
         return meals if isinstance(meals, list) else [meals]
     
     async def get_stars(self) -> List[Dict]:
-        """Получить категории отелей"""
-        data = await self._request("list.php", {"type": "stars"})
+        """Получить категории отелей (общий кэшированный список — только для чтения)"""
+        data = await self._request_dictionary({"type": "stars"})
         stars = data.get("lists", {}).get("stars", {}).get("star", [])
         return stars if isinstance(stars, list) else [stars]
     
     async def get_operators(self, departure_id: Optional[int] = None, country_id: Optional[int] = None) -> List[Dict]:
-        """Получить туроператоров"""
+        """Получить туроператоров (общий кэшированный список — только для чтения)"""
         params = {"type": "operator"}
         if departure_id:
             params["flydeparture"] = departure_id
         if country_id:
             params["flycountry"] = country_id
-        data = await self._request("list.php", params)
+        data = await self._request_dictionary(params)
         operators = data.get("lists", {}).get("operators", {}).get("operator", [])
         return operators if isinstance(operators, list) else [operators]
     
     async def get_services(self) -> List[Dict]:
-        """Получить услуги отелей"""
-        data = await self._request("list.php", {"type": "services"})
+        """Получить услуги отелей (общий кэшированный список — только для чтения)"""
+        data = await self._request_dictionary({"type": "services"})
         services = data.get("lists", {}).get("services", {}).get("service", [])
         return services if isinstance(services, list) else [services]
     
@@ -293,15 +456,17 @@ class TourVisorClient:
                 date_to = (datetime.now() + timedelta(days=8)).strftime("%d.%m.%Y")
         
         # Валидация: dateto не может быть раньше datefrom
-        try:
-            df = datetime.strptime(date_from, "%d.%m.%Y")
-            dt = datetime.strptime(date_to, "%d.%m.%Y")
-            if dt < df:
-                logger.warning("⚠️ dateto (%s) раньше datefrom (%s) — автокоррекция: dateto = datefrom",
-                               date_to, date_from)
-                date_to = date_from
-        except (ValueError, TypeError):
-            pass
+        # (одинаковые даты — частый случай после нормализации в handler'е, парсить нечего)
+        if date_to != date_from:
+            try:
+                df = datetime.strptime(date_from, "%d.%m.%Y")
+                dt = datetime.strptime(date_to, "%d.%m.%Y")
+                if dt < df:
+                    logger.warning("⚠️ dateto (%s) раньше datefrom (%s) — автокоррекция: dateto = datefrom",
+                                   date_to, date_from)
+                    date_to = date_from
+            except (ValueError, TypeError):
+                pass
         
         params = {
             "departure": departure,
@@ -367,6 +532,8 @@ class TourVisorClient:
             request_id = data["result"].get("requestid")
         else:
             request_id = data.get("requestid")
+        if request_id:
+            self._search_started_at[str(request_id)] = time.monotonic()
         
         logger.info("🔎 SEARCH STARTED  requestid=%s  departure=%s country=%s dates=%s–%s nights=%s–%s adults=%s child=%s",
                      request_id, departure, country, date_from, date_to, nights_from, nights_to, adults, children)
@@ -422,14 +589,18 @@ class TourVisorClient:
         """
         Дождаться завершения поиска и вернуть результаты
         
+        poll_interval — максимальная пауза между опросами (см. next_poll_delay)
+        
         Raises:
             NoResultsError: Поиск завершён, но туры не найдены
             SearchNotFoundError: requestid недействителен
         """
-        start = datetime.now()
+        deadline = time.monotonic() + max_wait
         last_status = {}
+        attempt = 0
+        await self.wait_first_poll(request_id)
         
-        while (datetime.now() - start).total_seconds() < max_wait:
+        while time.monotonic() < deadline:
             try:
                 last_status = await self.get_search_status(request_id)
             except SearchNotFoundError:
@@ -450,7 +621,8 @@ class TourVisorClient:
                 
                 return await self.get_search_results(request_id)
             
-            await asyncio.sleep(poll_interval)
+            await asyncio.sleep(next_poll_delay(attempt, poll_interval))
+            attempt += 1
         
         # Timeout — возвращаем что есть (может быть частичный результат)
         hotels = last_status.get("hotelsfound", 0)
@@ -462,6 +634,18 @@ class TourVisorClient:
         
         return await self.get_search_results(request_id)
     
+    async def wait_first_poll(self, request_id: str):
+        """
+        Выдержать SEARCH_POLL_INITIAL_DELAY от запуска поиска (search_tours/continue_search
+        этим клиентом) до первого опроса статуса. Если поиск запущен давно — не ждём.
+        """
+        started = self._search_started_at.pop(str(request_id), None)
+        if started is None:
+            return
+        remaining = SEARCH_POLL_INITIAL_DELAY - (time.monotonic() - started)
+        if remaining > 0:
+            await asyncio.sleep(remaining)
+    
     # ==================== АКТУАЛИЗАЦИЯ ====================
     
     async def actualize_tour(
@@ -572,6 +756,7 @@ class TourVisorClient:
         Каждое продолжение считается отдельным запросом в лимит!
         """
         data = await self._request("search.php", {"continue": request_id})
+        self._search_started_at[str(request_id)] = time.monotonic()
         page = data.get("result", {}).get("page", "2")
         logger.info("➡️ CONTINUE SEARCH  requestid=%s  page=%s", request_id, page)
         return {"page": page}
@@ -579,8 +764,13 @@ class TourVisorClient:
     # ==================== ЗАКРЫТИЕ ====================
     
     async def close(self):
-        """Закрыть клиент (заглушка — httpx.AsyncClient создаётся на каждый запрос)"""
-        pass
+        """Закрыть пул соединений (вызывать в том же event loop, где шли запросы)"""
+        client, loop = self._http, self._http_loop
+        self._http = self._http_loop = None
+        if client is None or client.is_closed:
+            return
+        if loop is asyncio.get_running_loop():
+            await client.aclose()
     
     # ==================== ГОРЯЩИЕ ТУРЫ ====================
     
@@ -719,14 +909,14 @@ async def main():
     client = TourVisorClient()
     
     try:
-        # Тест справочников
+        # Тест справочников (независимые запросы — параллельно)
+        departures, meals = await asyncio.gather(client.get_departures(), client.get_meals())
+        
         print("Города вылета:")
-        departures = await client.get_departures()
         for d in departures[:5]:
             print(f"  {d['id']}: {d['name']} (из {d.get('namefrom', '-')})")
         
         print("\nТипы питания:")
-        meals = await client.get_meals()
         for m in meals:
             print(f"  {m['id']}: {m['name']} - {m.get('russianfull', m.get('russian', '-'))}")
         
@@ -11,24 +11,31 @@ import asyncio
 import time
 import logging
 import re
-from datetime import datetime as _dt, timedelta as _td
-from typing import Optional, Dict, Any, List, Callable, AsyncIterator, Tuple
+from functools import lru_cache
+from types import MappingProxyType
+from datetime import date as _date, datetime as _dt, timedelta as _td
+from typing import Optional, Dict, Any, List, Callable, AsyncIterator, Iterator, Tuple
 from openai import OpenAI
-from dotenv import load_dotenv
+# .env загружается один раз — при импорте tourvisor_client
 from tourvisor_client import (
     TourVisorClient,
     TourIdExpiredError,
     SearchNotFoundError,
-    NoResultsError
+    NoResultsError,
+    next_poll_delay
 )
 
-load_dotenv()
-
 logger = logging.getLogger("mgp_bot")
 
 # Тип для callback функции streaming
 StreamCallback = Callable[[str], None]
 
+# ─── Функции, которые можно выполнять параллельно ───
+# Только чтение, без состояния handler'а. Остальные (search_tours → get_search_status →
+# get_search_results, continue_search, get_hot_tours) зависят от результата предыдущих
+# вызовов и пишут _pending_tour_cards — их выполняем строго в порядке, заданном моделью.
+_PARALLEL_SAFE_FUNCTIONS = frozenset(("get_dictionaries", "get_hotel_info", "get_current_date", "get_tour_details"))
+
 
 def _is_self_moderation(text: str) -> bool:
     """
@@ -85,14 +92,225 @@ def _is_promised_search(text: str) -> bool:
     return any(phrase in lower for phrase in promise_phrases)
 
 
-def _check_cascade_slots(full_history: List[Dict], args: Dict) -> Tuple[bool, List[str]]:
+def _compile_any(patterns) -> "re.Pattern[str]":
+    """
+    Объединяет список паттернов в одну альтернацию.
+    Один проход re.search вместо N отдельных поисков по тексту истории.
+    """
+    return re.compile("|".join(f"(?:{p})" for p in patterns))
+
+
+# ─── Паттерны слотов каскада (компилируются один раз при импорте) ───
+# Синхронизировано с system_prompt.md § 0.0.2 / § 0.4
+
+# Слот 2: Город вылета
+# Паттерны: названия городов вылета, "вылет из ...", "из москвы" и т.д.
+_DEPARTURE_RE = _compile_any((
+    # Конкретные города вылета TourVisor
+    r'\b(?:москв[аыуе]|мск)\b',
+    r'\b(?:петербург\w*|питер\w*|спб|санкт-петербург\w*)\b',
+    r'\b(?:екатеринбург\w*|еката)\b',
+    r'\b(?:новосибирск\w*)\b',
+    r'\b(?:казан[ьи]\w*)\b',
+    r'\b(?:краснодар\w*)\b',
+    r'\b(?:красноярск\w*)\b',
+    r'\b(?:самар\w*)\b',
+    r'\b(?:уф[аыуе]\w*)\b',
+    r'\b(?:перм[ьи]\w*)\b',
+    r'\b(?:челябинск\w*)\b',
+    r'\b(?:ростов\w*)\b',
+    r'\b(?:минеральн\w+\s*вод|мин\s*вод)\b',
+    r'\b(?:тюмен[ьи])\b',
+    r'\b(?:нижн\w+\s*новгород|нижний)\b',
+    r'\b(?:волгоград)\b',
+    r'\b(?:воронеж)\b',
+    r'\b(?:омск)\b',
+    r'\b(?:иркутск)\b',
+    r'\b(?:хабаровск)\b',
+    # НЕ включаем Сочи — это чаще курорт (направление), а не город вылета
+    # Обобщённые паттерны: "вылет из ...", "летим из ..."
+    r'(?:вылет|вылетаем|летим|улетаем)\s+(?:из|с)\s+\w+',
+    r'(?:из|с)\s+\w+\s+(?:вылет|вылетаем|улетаем)',
+))
+
+# Слот 3: Даты/месяц вылета
+# Паттерны для дат: числа с месяцами, названия месяцев, относительные даты
+_DATE_RE = _compile_any((
+    r'\d{1,2}\.\d{1,2}(?:\.\d{2,4})?',  # 21.03 или 21.03.2026
+    r'\d{1,2}\s+(?:января|февраля|марта|апреля|мая|июня|июля|августа|сентября|октября|ноября|декабря)',
+    r'(?:январ[еья]|феврал[еья]|март[еа]?|апрел[еья]|ма[еяй]|июн[еья]|июл[еья]|август[еа]?|сентябр[еья]|октябр[еья]|ноябр[еья]|декабр[еья])',
+    r'(?:в\s+)?(?:начале|середине|конце)\s+(?:января|февраля|марта|апреля|мая|июня|июля|августа|сентября|октября|ноября|декабря|месяца)',
+    r'(?:на\s+)?(?:майские|новогодние|новый год|8 марта|23 февраля)',
+    r'(?:завтра|послезавтра|через\s+\w+\s+дн|через\s+неделю|через\s+месяц)',
+    r'(?:в\s+)?(?:этом|следующем)\s+месяце',
+    r'(?:в\s+)?ближайшее\s+время',
+    r'(?:первой|второй)\s+половин[еы]',
+))
+
+# Слот 3: Длительность (ночи/дни)
+_NIGHTS_RE = _compile_any((
+    r'\d+\s*(?:ноч|дн|день|дней|ночей)',
+    r'(?:на\s+)?(?:неделю|недельку|две недели|2 недели)',
+    r'\bнедел[яюи]\b',  # "неделя", "неделю", "недели" без "на"
+    r'(?:на\s+)?(?:выходные|уикенд)',
+    r'(?:с\s+)?\d{1,2}(?:\.\d{1,2})?(?:\s+)?(?:по|-)(?:\s+)?\d{1,2}',  # с 10 по 17, 10-17
+))
+
+# Слот 4: Состав путешественников
+_TRAVELERS_RE = _compile_any((
+    r'(?:взрослы[хй]|взр\.?|adults)',
+    r'(?:дет(?:ей|и|ьми|ям)?|ребен(?:ок|ка)|child)',
+    r'(?:я\s+)?(?:один|одна|сам|одиночк)',
+    r'(?:двое|два|две)\s+(?:взрослы[хй]|человек|чел\.?)',  # "двое взрослых", "два человека"
+    r'(?:трое|три|четыре|пять|шесть)\s+(?:взрослы[хй]|человек|чел\.?)',
+    r'\d+\s*(?:взрослы[хй]|человек|чел\.?|взр)',  # "2 взрослых", "3 человека", "2в"
+    r'\d+\s*в\s*\+',  # "2в+" — shorthand
+    r'(?:с\s+)?(?:мужем|женой|парнем|девушкой|подругой|другом)',
+    r'(?:вдво[её]м|втро[её]м|вчетвером|впятером)',
+    r'(?:семь[её]й|компанией|группой)',
+    r'(?:мы\s+с\s+)',
+))
+
+# Слот 5: Quality Check (звёздность + питание)
+_STARS_RE = _compile_any((
+    r'\d\s*(?:звёзд|звезд|\*|⭐)',      # "5 звёзд", "4*", "5⭐"
+    r'(?:пяти|четырёх|четырех|трёх|трех)звёзд',  # "пятизвёздочный"
+))
+_MEAL_RE = _compile_any((
+    r'(?:всё?\s*включен|all\s*incl|[ауа]и|ai\b|uai\b)',   # "всё включено", "all inclusive", "AI", "UAI"
+    r'(?:полупансион|half\s*board|hb\b)',
+    r'(?:полный\s*пансион|full\s*board|fb\b)',
+    r'(?:только\s*)?завтрак[аи]?\b',
+    r'\b(?:bb|ro|ob)\b',  # bed&breakfast, room only, only bed
+))
+_SKIP_QUALITY_RE = _compile_any((
+    # Контекстные паттерны: "любой" только в связке со звёздностью/отелем/питанием
+    r'(?:любой|любую|любое|любые)\s+(?:отель|категори|звёзд|звезд|питани)',
+    r'(?:любой|любая|любое)\b',  # одиночный ответ "любой" на вопрос QC (последнее сообщение)
+    r'(?:без\s*разницы|всё\s*равно|все\s*равно)',
+    r'(?:не\s*важно|неважно|не\s*принципиально)',
+    r'(?:на\s+(?:ваше?|твоё?|твое?)\s+усмотрени)',
+    r'(?:рассмотрим\s+вариант|покажите?\s+что\s+есть|какие\s+есть)',
+    r'(?:покажите?\s+что-нибудь|что\s+посоветуете)',
+))
+# Бренды/конкретные отели — тоже skip quality check
+_HOTEL_BRAND_RE = _compile_any((
+    r'\b(?:rixos|hilton|delphin|swissotel|kempinski|calista|titanic|gloria|regnum|maxx\s*royal)\b',
+    r'\b(?:iberostar|marriott|sheraton|radisson|accor|hyatt|intercontinental)\b',
+    # "отель [Название с заглавной]" — но НЕ "отель красивый"
+    # Этот паттерн ловит только конкретные упоминания с "хочу в отель ..."
+    r'(?:в\s+)?отел[ьеи]\s+[а-яА-Яa-zA-Z]{3,}',
+))
+# Фразы ассистента, означающие что вопрос Quality Check уже задан
+_QC_ASKED_PHRASES = (
+    "категорию отеля", "тип питания", "звёзд", "питание предпочитаете",
+    "какой отель", "звёздность", "всё включено",
+)
+
+# Вопрос клиенту для каждого недостающего слота (правило § 0.3: ОДИН чёткий вопрос)
+_CASCADE_NUDGES = MappingProxyType({
+    "город вылета": "'Из какого города планируете вылет?'",
+    "даты/месяц и длительность": "'Когда планируете поездку и на сколько ночей?'",
+    "даты/месяц вылета": "'В каком месяце планируете вылет?'",
+    "состав путешественников": "'Сколько взрослых едет и будут ли с вами дети?'",
+    "категорию отеля и тип питания (Quality Check)": "'Какую категорию отеля и тип питания предпочитаете?'",
+})
+
+# Возрасты детей в аргументах search_tours (TourVisor принимает до 3)
+_CHILD_AGE_KEYS = ("childage1", "childage2", "childage3")
+
+# Ключевые параметры search_tours: если не переданы — поиск идёт с дефолтами (логируем)
+_SEARCH_KEY_PARAMS = ("adults", "datefrom", "dateto", "stars", "meal")
+
+# Флаги исключений из тура → предупреждение для AI (порядок сохраняется в выдаче)
+_TOUR_WARNING_FLAGS = (
+    ("nightflight", "ночной перелёт"),
+    ("noflight", "без перелёта"),
+    ("notransfer", "без трансфера"),
+    ("nomedinsurance", "без мед.страховки"),
+    ("nomeal", "без питания"),
+    ("onrequest", "под запрос"),
+)
+
+# Курорты по странам для проверки «курорт без regions» (Fix P3)
+# Формат: (скомпилированный паттерн, страна_для_подсказки)
+_RESORT_PATTERNS = (
+    # Россия (country=47)
+    (re.compile(r'\b(?:кисловодск|пятигорск|ессентуки|железноводск|минеральн\w*\s*вод)\b'), "России"),
+    (re.compile(r'\b(?:сочи|адлер|красн\w*\s*полян)\b'), "России"),
+    (re.compile(r'\b(?:анап[аыуе]|геленджик|новоросс)\b'), "России"),
+    (re.compile(r'\b(?:крым|ялт[аыуе]|алушт[аыуе]|севастопол|феодоси|судак|евпатори)\b'), "России"),
+    (re.compile(r'\b(?:калининград|светлогорск|зеленоградск)\b'), "России"),
+    # Таиланд (country=2)
+    (re.compile(r'\b(?:пхукет|пукет)\b'), "Таиланда"),
+    (re.compile(r'\b(?:паттай[яеу]|паттая)\b'), "Таиланда"),
+    (re.compile(r'\b(?:самуи)\b'), "Таиланда"),
+    (re.compile(r'\b(?:краби)\b'), "Таиланда"),
+    (re.compile(r'\b(?:хуа\s*хин)\b'), "Таиланда"),
+    # Турция (country=4)
+    (re.compile(r'\b(?:алан[ьи]я|аланья)\b'), "Турции"),
+    (re.compile(r'\b(?:анталь?я|анталия)\b'), "Турции"),
+    (re.compile(r'\b(?:кемер)\b'), "Турции"),
+    (re.compile(r'\b(?:сиде)\b'), "Турции"),
+    (re.compile(r'\b(?:белек)\b'), "Турции"),
+    (re.compile(r'\b(?:бодрум)\b'), "Турции"),
+    (re.compile(r'\b(?:мармарис)\b'), "Турции"),
+    (re.compile(r'\b(?:фетхие|фетие)\b'), "Турции"),
+    (re.compile(r'\b(?:кушадас)\b'), "Турции"),
+    (re.compile(r'\b(?:стамбул)\b'), "Турции"),
+    # Египет (country=1)
+    (re.compile(r'\b(?:шарм|шарм-эль-шейх|шарм\s*эль\s*шейх)\b'), "Египта"),
+    (re.compile(r'\b(?:хургад[аыуе])\b'), "Египта"),
+    (re.compile(r'\b(?:марса\s*алам)\b'), "Египта"),
+    (re.compile(r'\b(?:дахаб)\b'), "Египта"),
+    # ОАЭ (country=9)
+    (re.compile(r'\b(?:дубай|дубаи)\b'), "ОАЭ"),
+    (re.compile(r'\b(?:абу[\s-]*даби)\b'), "ОАЭ"),
+    (re.compile(r'\b(?:шардж[аеу])\b'), "ОАЭ"),
+    (re.compile(r'\b(?:рас[\s-]*аль[\s-]*хайм)\b'), "ОАЭ"),
+    # Вьетнам (country=16)
+    (re.compile(r'\b(?:фукуок|фу\s*куок)\b'), "Вьетнама"),
+    (re.compile(r'\b(?:нячанг|ня\s*чанг)\b'), "Вьетнама"),
+    (re.compile(r'\b(?:фантьет|фан\s*тьет|муйне|муй\s*не)\b'), "Вьетнама"),
+    # Шри-Ланка
+    (re.compile(r'\b(?:коломбо|бентот[аы]|хиккадув[аы]|унаватун[аы])\b'), "Шри-Ланки"),
+    # Мальдивы
+    (re.compile(r'\b(?:мале|маафуш)\b'), "Мальдив"),
+    # Куба
+    (re.compile(r'\b(?:варадеро|гаван[аы])\b'), "Кубы"),
+    # Доминикана
+    (re.compile(r'\b(?:пунта[\s-]*кан[аы]|бока[\s-]*чик[аы])\b'), "Доминиканы"),
+)
+# Общий паттерн — один проход по тексту вместо ~35, когда курорт не упомянут (частый случай).
+# При совпадении нужен порядок _RESORT_PATTERNS (приоритет), поэтому потом идём по списку.
+_RESORT_ANY_RE = re.compile("|".join(f"(?:{pattern.pattern})" for pattern, _ in _RESORT_PATTERNS))
+
+# Шаблоны ошибок блокирующих проверок search_tours (статическая часть собирается один раз)
+_CASCADE_INCOMPLETE_ERROR = (
+    "СИСТЕМНАЯ ОШИБКА ВАЛИДАЦИИ КАСКАДА: Клиент НЕ указал {slot}! "
+    "ОБЯЗАТЕЛЬНО спроси клиента ЯВНО: {nudge}. "
+    "Задай ТОЛЬКО ОДИН вопрос, не перечисляй список! "
+    "НЕ вызывай search_tours пока клиент не ответит!"
+)
+_RESORT_NO_REGION_ERROR = (
+    "СИСТЕМНАЯ ОШИБКА: Клиент указал конкретный курорт '{resort}', "
+    "но ты НЕ передал параметр regions в search_tours! "
+    "ОБЯЗАТЕЛЬНО определи код региона: вызови get_dictionaries(type='region', regcountry={country}) "
+    "и найди код для '{resort}'. Затем передай regions=КОД в search_tours. "
+    "Без regions поиск вернёт туры по ВСЕЙ стране, а не по указанному курорту!"
+)
+_RESORT_NO_REGION_HINT = "Определи код региона '{resort}' через get_dictionaries и передай в regions."
+
+
+def _iter_missing_cascade_slots(full_history: List[Dict]) -> Iterator[str]:
     """
-    Проверяет, что клиент ЯВНО указал критичные слоты каскада:
+    Перебирает НЕуказанные клиентом критичные слоты каскада в порядке приоритета:
       Слот 2 — город вылета
       Слот 3 — даты и длительность
       Слот 4 — состав путешественников
       Слот 5 — Quality Check (звёздность / питание) ИЛИ явный skip
-    Возвращает (is_complete, missing_slots).
+    Генератор: вызывающему, которому нужен только первый слот, не приходится
+    прогонять паттерны остальных.
     
     Синхронизировано с system_prompt.md § 0.0.2 / § 0.4
     
@@ -101,8 +319,6 @@ def _check_cascade_slots(full_history: List[Dict], args: Dict) -> Tuple[bool, Li
     - Ищем паттерны, указывающие на явное упоминание каждого слота
     - Если не найдено — слот считается пропущенным
     """
-    missing = []
-    
     # Собираем последние 20 сообщений пользователя
     user_messages = [
         msg.get("content", "") for msg in full_history[-20:] 
@@ -111,159 +327,56 @@ def _check_cascade_slots(full_history: List[Dict], args: Dict) -> Tuple[bool, Li
     user_text = " ".join(user_messages).lower()
     
     # ─── Слот 2: Город вылета ───
-    # Паттерны: названия городов вылета, "вылет из ...", "из москвы" и т.д.
-    departure_patterns = [
-        # Конкретные города вылета TourVisor
-        r'\b(?:москв[аыуе]|мск)\b',
-        r'\b(?:петербург\w*|питер\w*|спб|санкт-петербург\w*)\b',
-        r'\b(?:екатеринбург\w*|еката)\b',
-        r'\b(?:новосибирск\w*)\b',
-        r'\b(?:казан[ьи]\w*)\b',
-        r'\b(?:краснодар\w*)\b',
-        r'\b(?:красноярск\w*)\b',
-        r'\b(?:самар\w*)\b',
-        r'\b(?:уф[аыуе]\w*)\b',
-        r'\b(?:перм[ьи]\w*)\b',
-        r'\b(?:челябинск\w*)\b',
-        r'\b(?:ростов\w*)\b',
-        r'\b(?:минеральн\w+\s*вод|мин\s*вод)\b',
-        r'\b(?:тюмен[ьи])\b',
-        r'\b(?:нижн\w+\s*новгород|нижний)\b',
-        r'\b(?:волгоград)\b',
-        r'\b(?:воронеж)\b',
-        r'\b(?:омск)\b',
-        r'\b(?:иркутск)\b',
-        r'\b(?:хабаровск)\b',
-        # НЕ включаем Сочи — это чаще курорт (направление), а не город вылета
-        # Обобщённые паттерны: "вылет из ...", "летим из ..."
-        r'(?:вылет|вылетаем|летим|улетаем)\s+(?:из|с)\s+\w+',
-        r'(?:из|с)\s+\w+\s+(?:вылет|вылетаем|улетаем)',
-    ]
-    has_departure_mention = any(re.search(p, user_text) for p in departure_patterns)
-    
-    if not has_departure_mention:
-        missing.append("город вылета")
-    
-    # ─── Слот 3: Даты/месяц вылета ───
-    # Паттерны для дат: числа с месяцами, названия месяцев, относительные даты
-    date_patterns = [
-        r'\d{1,2}\.\d{1,2}(?:\.\d{2,4})?',  # 21.03 или 21.03.2026
-        r'\d{1,2}\s+(?:января|февраля|марта|апреля|мая|июня|июля|августа|сентября|октября|ноября|декабря)',
-        r'(?:январ[еья]|феврал[еья]|март[еа]?|апрел[еья]|ма[еяй]|июн[еья]|июл[еья]|август[еа]?|сентябр[еья]|октябр[еья]|ноябр[еья]|декабр[еья])',
-        r'(?:в\s+)?(?:начале|середине|конце)\s+(?:января|февраля|марта|апреля|мая|июня|июля|августа|сентября|октября|ноября|декабря|месяца)',
-        r'(?:на\s+)?(?:майские|новогодние|новый год|8 марта|23 февраля)',
-        r'(?:завтра|послезавтра|через\s+\w+\s+дн|через\s+неделю|через\s+месяц)',
-        r'(?:в\s+)?(?:этом|следующем)\s+месяце',
-        r'(?:в\s+)?ближайшее\s+время',
-        r'(?:первой|второй)\s+половин[еы]',
-    ]
-    has_date_mention = any(re.search(p, user_text) for p in date_patterns)
-    
-    # ─── Слот 3: Длительность (ночи/дни) ───
-    nights_patterns = [
-        r'\d+\s*(?:ноч|дн|день|дней|ночей)',
-        r'(?:на\s+)?(?:неделю|недельку|две недели|2 недели)',
-        r'\bнедел[яюи]\b',  # "неделя", "неделю", "недели" без "на"
-        r'(?:на\s+)?(?:выходные|уикенд)',
-        r'(?:с\s+)?\d{1,2}(?:\.\d{1,2})?(?:\s+)?(?:по|-)(?:\s+)?\d{1,2}',  # с 10 по 17, 10-17
-    ]
-    has_nights_mention = any(re.search(p, user_text) for p in nights_patterns)
+    if not _DEPARTURE_RE.search(user_text):
+        yield "город вылета"
     
+    # ─── Слот 3: Даты/месяц вылета + длительность ───
     # Если нет ни дат, ни длительности — слот 3 пропущен
-    if not has_date_mention and not has_nights_mention:
-        missing.append("даты/месяц и длительность")
-    elif not has_date_mention:
-        missing.append("даты/месяц вылета")
+    if _DATE_RE.search(user_text) is None:
+        if _NIGHTS_RE.search(user_text) is None:
+            yield "даты/месяц и длительность"
+        else:
+            yield "даты/месяц вылета"
     # Примечание: если есть дата, но нет длительности — это может быть OK
     # (например, "с 10 по 17 марта" уже содержит длительность)
     
     # ─── Слот 4: Состав путешественников ───
-    travelers_patterns = [
-        r'(?:взрослы[хй]|взр\.?|adults)',
-        r'(?:дет(?:ей|и|ьми|ям)?|ребен(?:ок|ка)|child)',
-        r'(?:я\s+)?(?:один|одна|сам|одиночк)',
-        r'(?:двое|два|две)\s+(?:взрослы[хй]|человек|чел\.?)',  # "двое взрослых", "два человека"
-        r'(?:трое|три|четыре|пять|шесть)\s+(?:взрослы[хй]|человек|чел\.?)',
-        r'\d+\s*(?:взрослы[хй]|человек|чел\.?|взр)',  # "2 взрослых", "3 человека", "2в"
-        r'\d+\s*в\s*\+',  # "2в+" — shorthand
-        r'(?:с\s+)?(?:мужем|женой|парнем|девушкой|подругой|другом)',
-        r'(?:вдво[её]м|втро[её]м|вчетвером|впятером)',
-        r'(?:семь[её]й|компанией|группой)',
-        r'(?:мы\s+с\s+)',
-    ]
-    has_travelers_mention = any(re.search(p, user_text) for p in travelers_patterns)
-    
-    if not has_travelers_mention:
-        missing.append("состав путешественников")
+    if not _TRAVELERS_RE.search(user_text):
+        yield "состав путешественников"
     
     # ─── Слот 5: Quality Check (звёздность + питание) ───
-    # Проверяем: клиент ЯВНО указал stars/meal ИЛИ явно "скипнул" (любой/не важно/и т.д.)
-    # Также skip если клиент назвал конкретный отель/бренд (stars берётся из базы)
-    
-    stars_patterns = [
-        r'\d\s*(?:звёзд|звезд|\*|⭐)',      # "5 звёзд", "4*", "5⭐"
-        r'(?:пяти|четырёх|четырех|трёх|трех)звёзд',  # "пятизвёздочный"
-    ]
-    meal_patterns = [
-        r'(?:всё?\s*включен|all\s*incl|[ауа]и|ai\b|uai\b)',   # "всё включено", "all inclusive", "AI", "UAI"
-        r'(?:полупансион|half\s*board|hb\b)',
-        r'(?:полный\s*пансион|full\s*board|fb\b)',
-        r'(?:только\s*)?завтрак[аи]?\b',
-        r'\b(?:bb|ro|ob)\b',  # bed&breakfast, room only, only bed
-    ]
-    skip_quality_patterns = [
-        # Контекстные паттерны: "любой" только в связке со звёздностью/отелем/питанием
-        r'(?:любой|любую|любое|любые)\s+(?:отель|категори|звёзд|звезд|питани)',
-        r'(?:любой|любая|любое)\b',  # одиночный ответ "любой" на вопрос QC (последнее сообщение)
-        r'(?:без\s*разницы|всё\s*равно|все\s*равно)',
-        r'(?:не\s*важно|неважно|не\s*принципиально)',
-        r'(?:на\s+(?:ваше?|твоё?|твое?)\s+усмотрени)',
-        r'(?:рассмотрим\s+вариант|покажите?\s+что\s+есть|какие\s+есть)',
-        r'(?:покажите?\s+что-нибудь|что\s+посоветуете)',
-    ]
-    # Бренды/конкретные отели — тоже skip quality check
-    hotel_brand_patterns = [
-        r'\b(?:rixos|hilton|delphin|swissotel|kempinski|calista|titanic|gloria|regnum|maxx\s*royal)\b',
-        r'\b(?:iberostar|marriott|sheraton|radisson|accor|hyatt|intercontinental)\b',
-        # "отель [Название с заглавной]" — но НЕ "отель красивый"
-        # Этот паттерн ловит только конкретные упоминания с "хочу в отель ..."
-        r'(?:в\s+)?отел[ьеи]\s+[а-яА-Яa-zA-Z]{3,}',
-    ]
-    
-    # stars/meal/brand ищем по ВСЕМ сообщениям (user_text)
-    has_stars = any(re.search(p, user_text) for p in stars_patterns)
-    has_meal = any(re.search(p, user_text) for p in meal_patterns)
-    has_brand = any(re.search(p, user_text) for p in hotel_brand_patterns)
-    
-    # skip_quality ищем ТОЛЬКО по последнему сообщению пользователя
-    # (чтобы "любой курорт" из раннего сообщения не пометил QC как пройденный)
-    last_user_msg = user_messages[-1].lower() if user_messages else ""
-    has_skip = any(re.search(p, last_user_msg) for p in skip_quality_patterns)
-    
     # Quality Check пройден если:
     # - клиент указал хотя бы stars ИЛИ meal
     # - ИЛИ клиент явно скипнул ("любой", "не важно")
-    # - ИЛИ клиент назвал конкретный бренд/отель
-    quality_check_passed = has_stars or has_meal or has_skip or has_brand
-    
-    if not quality_check_passed:
-        # Проверяем: может быть модель уже задала вопрос о QC, 
-        # а клиент ответил чем-то неожиданным — не блокируем повторно
-        # Ищем в истории ассистента вопрос про звёздность/питание
-        assistant_messages = [
-            msg.get("content", "") for msg in full_history[-10:] 
-            if msg.get("role") == "assistant" and msg.get("content")
-        ]
-        assistant_text = " ".join(assistant_messages).lower()
-        qc_asked = any(phrase in assistant_text for phrase in [
-            "категорию отеля", "тип питания", "звёзд", "питание предпочитаете",
-            "какой отель", "звёздность", "всё включено"
-        ])
-        # Если ассистент УЖЕ спрашивал QC и клиент ответил (есть следующее сообщение) — 
-        # считаем что клиент явно или неявно скипнул
-        if not qc_asked:
-            missing.append("категорию отеля и тип питания (Quality Check)")
-    
+    # - ИЛИ клиент назвал конкретный бренд/отель (stars берётся из базы)
+    # stars/meal/brand ищем по ВСЕМ сообщениям (user_text),
+    # skip — ТОЛЬКО по последнему сообщению пользователя
+    # (чтобы "любой курорт" из раннего сообщения не пометил QC как пройденный)
+    last_user_msg = user_messages[-1].lower() if user_messages else ""
+    if (_STARS_RE.search(user_text) or _MEAL_RE.search(user_text)
+            or _SKIP_QUALITY_RE.search(last_user_msg) or _HOTEL_BRAND_RE.search(user_text)):
+        return
+    
+    # Проверяем: может быть модель уже задала вопрос о QC, 
+    # а клиент ответил чем-то неожиданным — не блокируем повторно
+    # Ищем в истории ассистента вопрос про звёздность/питание
+    assistant_messages = [
+        msg.get("content", "") for msg in full_history[-10:] 
+        if msg.get("role") == "assistant" and msg.get("content")
+    ]
+    assistant_text = " ".join(assistant_messages).lower()
+    # Если ассистент УЖЕ спрашивал QC и клиент ответил (есть следующее сообщение) — 
+    # считаем что клиент явно или неявно скипнул
+    if not any(phrase in assistant_text for phrase in _QC_ASKED_PHRASES):
+        yield "категорию отеля и тип питания (Quality Check)"
+
+
+def _check_cascade_slots(full_history: List[Dict], args: Dict) -> Tuple[bool, List[str]]:
+    """
+    Проверяет, что клиент ЯВНО указал критичные слоты каскада.
+    Возвращает (is_complete, missing_slots) — полный список пропущенных слотов.
+    """
+    missing = list(_iter_missing_cascade_slots(full_history))
     return len(missing) == 0, missing
 
 
@@ -273,6 +386,11 @@ def _safe_int(val, default: int = 0) -> int:
     TourVisor API возвращает числа как строки, float или int в разных контекстах.
     Обрабатывает: "45000", 45000, "45000.50", 45000.5, None, "", "N/A"
     """
+    # Быстрый путь для частых случаев: уже int или целое число строкой
+    if type(val) is int:
+        return val
+    if type(val) is str and val.isdecimal():
+        return int(val)
     if val is None or val == "":
         return default
     try:
@@ -281,17 +399,34 @@ def _safe_int(val, default: int = 0) -> int:
         return default
 
 
+# ─── Даты TourVisor ───
+_TV_DATE_FMT = "%d.%m.%Y"
+# Те же шаблоны, что у strptime для %d.%m.%Y (день допускает « 1», год — строго 4 цифры)
+_TV_DATE_RE = re.compile(r"(3[01]|[12]\d|0[1-9]|[1-9]| [1-9])\.(1[0-2]|0[1-9]|[1-9])\.(\d\d\d\d)")
+_ONE_DAY = _td(days=1)
+_WEEKDAYS_RU = ("Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота", "Воскресенье")
+# Окно дат ВЫЛЕТА по умолчанию: datefrom … datefrom+2
+_DEPARTURE_WINDOW = _td(days=2)
+
+
 # ─── Маппинг кодов городов → названия (для tour_cards) ───
-_DEPARTURE_CITIES = {
+_DEPARTURE_CITIES = MappingProxyType({
     1: "Москва", 2: "Пермь", 3: "Екатеринбург", 4: "Уфа",
     5: "Санкт-Петербург", 6: "Челябинск", 7: "Самара",
     9: "Новосибирск", 10: "Казань", 11: "Краснодар",
     12: "Красноярск", 18: "Ростов-на-Дону", 56: "Сочи",
-}
+})
+
+
+def _tv_date(d) -> str:
+    """date/datetime → TourVisor 'DD.MM.YYYY' (целочисленное форматирование, без strftime)"""
+    return f"{d.day:02d}.{d.month:02d}.{d.year}"
 
 
 def _safe_float(val, default=None):
     """Безопасное преобразование в float (для hotelrating и т.п.)."""
+    if type(val) is float:
+        return val
     if val is None or val == "":
         return default
     try:
@@ -315,10 +450,15 @@ def _calc_end_date(date_str: str, nights):
     if not date_str or not nights:
         return None
     try:
-        d = _dt.strptime(date_str, "%d.%m.%Y")
-        d_end = d + _td(days=int(nights))
-        return d_end.strftime("%Y-%m-%d")
-    except (ValueError, TypeError):
+        # Разбор и вывод без strptime/strftime (вызывается на каждую карточку);
+        # _TV_DATE_RE принимает ровно то же, что strptime(date_str, "%d.%m.%Y")
+        m = _TV_DATE_RE.fullmatch(date_str)
+        if m is None:
+            return None
+        d = _date(int(m[3]), int(m[2]), int(m[1]))
+        # Сдвиг по порядковому номеру дня — без промежуточного timedelta
+        return _date.fromordinal(d.toordinal() + int(nights)).isoformat()
+    except (ValueError, TypeError, OverflowError):
         return None
 
 
@@ -334,14 +474,17 @@ def _map_hotel_to_card(hotel: dict, departure_city: str = "Москва") -> dic
 
     # meal — в simplified data уже содержит mealrussian (русское описание)
     meal_desc = tour.get("meal") or ""
+    # Поля, которые попадают в карточку дважды, вычисляем один раз
+    region = hotel.get("regionname") or ""
+    no_flight = bool(tour.get("noflight"))
 
     return {
         "hotel_name": hotel.get("hotelname") or "Отель",
         "hotel_stars": _safe_int(hotel.get("hotelstars")),
         "hotel_rating": _safe_float(hotel.get("hotelrating")),
         "country": hotel.get("countryname") or "",
-        "resort": hotel.get("regionname") or "",
-        "region": hotel.get("regionname") or "",
+        "resort": region,
+        "region": region,
         "date_from": _parse_tv_date(flydate_raw),
         "date_to": _calc_end_date(flydate_raw, nights),
         "nights": nights,
@@ -354,13 +497,13 @@ def _map_hotel_to_card(hotel: dict, departure_city: str = "Москва") -> dic
         "hotel_link": hotel.get("fulldesclink") or "#",
         "id": str(tour.get("tourid") or ""),
         "departure_city": departure_city,
-        "is_hotel_only": bool(tour.get("noflight")),
-        "flight_included": not bool(tour.get("noflight")),
+        "is_hotel_only": no_flight,
+        "flight_included": not no_flight,
         "operator": tour.get("operatorname") or "",
     }
 
 
-_MEAL_CODE_TO_RU = {
+_MEAL_CODE_TO_RU = MappingProxyType({
     "RO": "Без питания",
     "BB": "Только завтрак",
     "HB": "Завтрак и ужин",
@@ -369,7 +512,7 @@ _MEAL_CODE_TO_RU = {
     "FB+": "Полный пансион+",
     "AI": "Всё включено",
     "UAI": "Ультра всё включено",
-}
+})
 
 
 def _map_hot_tour_to_card(tour_data: dict) -> dict:
@@ -382,14 +525,15 @@ def _map_hot_tour_to_card(tour_data: dict) -> dict:
     price_pp = _safe_int(tour_data.get("price_per_person"))
     meal_code = tour_data.get("meal") or ""
     meal_ru = _MEAL_CODE_TO_RU.get(meal_code.strip(), meal_code)
+    region = tour_data.get("regionname") or ""
 
     return {
         "hotel_name": tour_data.get("hotelname") or "Отель",
         "hotel_stars": _safe_int(tour_data.get("hotelstars")),
         "hotel_rating": _safe_float(tour_data.get("hotelrating")),
         "country": tour_data.get("countryname") or "",
-        "resort": tour_data.get("regionname") or "",
-        "region": tour_data.get("regionname") or "",
+        "resort": region,
+        "region": region,
         "date_from": _parse_tv_date(flydate_raw),
         "date_to": _calc_end_date(flydate_raw, nights),
         "nights": nights,
@@ -408,6 +552,18 @@ def _map_hot_tour_to_card(tour_data: dict) -> dict:
     }
 
 
+def _real_photo(url: Optional[str]) -> Optional[str]:
+    """Ссылка на фото отеля или None, если это заглушка региона (/reg-…)"""
+    if url and "/reg-" not in url:
+        return url
+    return None
+
+
+def _truncate(text: str, limit: int) -> str:
+    """Обрезать текст до limit символов с «...» (одно чтение строки вместо трёх)"""
+    return text[:limit] + "..." if len(text) > limit else text
+
+
 def _dedup_response(text: str) -> str:
     """
     Удаляет дублированный контент из ответа модели.
@@ -438,6 +594,43 @@ def _dedup_response(text: str) -> str:
     return text
 
 
+@lru_cache(maxsize=None)
+def _read_tools() -> Tuple[Dict, ...]:
+    """Описания функций из function_schemas.json + встроенный web_search (кэш на процесс)"""
+    schema_path = os.path.join(os.path.dirname(__file__), "..", "function_schemas.json")
+    with open(schema_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    
+    # Загружаем custom functions
+    custom_tools = data.get("tools", [])
+    
+    # Добавляем встроенный web_search инструмент
+    web_search_tool = {
+        "type": "web_search",
+        "search_context_size": "medium"  # low | medium | high
+    }
+    
+    return tuple(custom_tools) + (web_search_tool,)
+
+
+@lru_cache(maxsize=None)
+def _read_system_prompt() -> str:
+    """Системный промпт из system_prompt.md (кэш на процесс)"""
+    prompt_path = os.path.join(os.path.dirname(__file__), "..", "system_prompt.md")
+    try:
+        with open(prompt_path, "r", encoding="utf-8") as f:
+            return f.read()
+    except FileNotFoundError:
+        return "Ты — AI-менеджер турагентства. Помогаешь клиентам найти и забронировать туры."
+
+
+# ─── Лимиты summary результатов функций в full_history (для fallback) ───
+# Для search_results / hotel_info / hot_tours — больше контекста (содержат карточки)
+_RICH_RESULT_FUNCTIONS = frozenset(("get_search_results", "get_hotel_info", "get_hot_tours"))
+_SUMMARY_LIMIT_RICH = 2000
+_SUMMARY_LIMIT = 1000
+
+
 class YandexGPTHandler:
     """Обработчик запросов к Yandex GPT с Function Calling (Responses API)"""
     
@@ -488,11 +681,16 @@ class YandexGPTHandler:
         self._pending_tour_cards: List[Dict] = []
         self._last_departure_city: str = "Москва"
         
+        # Каскад слотов уже пройден в этом диалоге — повторный скан истории не нужен
+        self._cascade_passed = False
+        
         # ── Метрики для мониторинга качества (Этап 3) ──
         self._metrics = {
             "promised_search_detections": 0,      # Детекции "обещанного поиска"
             "cascade_incomplete_detections": 0,   # Блокировки из-за неполного каскада
-            "dateto_corrections": 0,              # Исправления dateto
+            # Исправления dateto — только в вызовах search_tours, прошедших блокирующие
+            # проверки (т.е. ушедших в поиск); заблокированные вызовы не считаются
+            "dateto_corrections": 0,
             "total_searches": 0,                  # Всего вызовов search_tours
             "total_messages": 0,                  # Всего сообщений пользователя
         }
@@ -500,6 +698,15 @@ class YandexGPTHandler:
         logger.info("🤖 YandexGPTHandler INIT  model=%s  folder=%s  tools=%d",
                      self.model_uri, self.folder_id, len(self.tools))
     
+    @staticmethod
+    def preload():
+        """
+        Прочитать схемы функций и системный промпт заранее (при старте сервера),
+        чтобы первая сессия не платила за чтение и разбор файлов.
+        """
+        _read_tools()
+        _read_system_prompt()
+    
     def get_metrics(self) -> Dict[str, int]:
         """Возвращает метрики сессии для мониторинга"""
         return self._metrics.copy()
@@ -509,13 +716,33 @@ class YandexGPTHandler:
         Обрезает full_history если она превышает _max_history_len.
         Сохраняет первое сообщение (часто содержит контекст) + последние N.
         """
-        if len(self.full_history) > self._max_history_len:
-            old_len = len(self.full_history)
-            # Оставляем первые 2 + последние (_max_history_len - 2)
-            keep_start = 2
-            keep_end = self._max_history_len - keep_start
-            self.full_history = self.full_history[:keep_start] + self.full_history[-keep_end:]
-            logger.info("✂️ TRIM full_history: %d → %d messages", old_len, len(self.full_history))
+        old_len = len(self.full_history)
+        if old_len <= self._max_history_len:
+            return
+        # Оставляем первые 2 + последние (_max_history_len - 2):
+        # вырезаем середину на месте, без двух срезов и нового списка
+        keep_start = 2
+        keep_end = self._max_history_len - keep_start
+        del self.full_history[keep_start:old_len - keep_end]
+        logger.info("✂️ TRIM full_history: %d → %d messages", old_len, len(self.full_history))
+    
+    def _remember_function_results(self, func_names: List[str], function_results: List[Dict]):
+        """
+        Сохраняет summary результатов функций в full_history как assistant-сообщение
+        (для fallback без previous_response_id).
+        func_names и function_results идут в одном порядке.
+        """
+        # ⚡ Увеличен лимит — при 500 символах терялся контекст
+        #    (особенно данные отелей, цен и дат из search_results)
+        func_summary_parts = []
+        for func_name, result in zip(func_names, function_results):
+            limit = _SUMMARY_LIMIT_RICH if func_name in _RICH_RESULT_FUNCTIONS else _SUMMARY_LIMIT
+            func_summary_parts.append(f"[{func_name or '?'}]: {result.get('output', '')[:limit]}")
+        if func_summary_parts:
+            self.full_history.append({
+                "role": "assistant",
+                "content": "Результаты запросов:\n" + "\n".join(func_summary_parts)
+            })
     
     def _dialogue_log(self, direction: str, content: str):
         """Запись в диалоговый лог через callback из app.py"""
@@ -527,29 +754,12 @@ class YandexGPTHandler:
     
     def _load_tools(self) -> List[Dict]:
         """Загрузить описания функций из function_schemas.json"""
-        schema_path = os.path.join(os.path.dirname(__file__), "..", "function_schemas.json")
-        with open(schema_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        
-        # Загружаем custom functions
-        custom_tools = data.get("tools", [])
-        
-        # Добавляем встроенный web_search инструмент
-        web_search_tool = {
-            "type": "web_search",
-            "search_context_size": "medium"  # low | medium | high
-        }
-        
-        return custom_tools + [web_search_tool]
+        # Схемы читаются один раз на процесс; копия списка — на случай правок в сессии
+        return list(_read_tools())
     
     def _load_system_prompt(self) -> str:
         """Загрузить системный промпт (теперь это instructions)"""
-        prompt_path = os.path.join(os.path.dirname(__file__), "..", "system_prompt.md")
-        try:
-            with open(prompt_path, "r", encoding="utf-8") as f:
-                return f.read()
-        except FileNotFoundError:
-            return "Ты — AI-менеджер турагентства. Помогаешь клиентам найти и забронировать туры."
+        return _read_system_prompt()
     
     async def _execute_function(self, name: str, arguments: str, call_id: str) -> Dict:
         """Выполнить функцию и вернуть результат в новом формате"""
@@ -566,7 +776,8 @@ class YandexGPTHandler:
             result_str = json.dumps(result, ensure_ascii=False, default=str)
             elapsed_ms = int((time.perf_counter() - t0) * 1000)
             logger.info("🔧 FUNC CALL << %s  OK  %dms  result_size=%d chars", name, elapsed_ms, len(result_str))
-            logger.debug("🔧 FUNC RESULT [%s]: %s", name, result_str[:800] + ("…" if len(result_str) > 800 else ""))
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("🔧 FUNC RESULT [%s]: %s", name, result_str[:800] + ("…" if len(result_str) > 800 else ""))
             
             # Пишем в диалоговый лог результат функции (первые 2000 символов)
             self._dialogue_log("FUNC_RESULT", f"{name} -> {result_str[:2000]}{'…' if len(result_str) > 2000 else ''}")
@@ -597,669 +808,637 @@ class YandexGPTHandler:
                 "output": json.dumps({"error": error_msg}, ensure_ascii=False)
             }
     
-    async def _dispatch_function(self, name: str, args: Dict) -> Any:
-        """Маршрутизация вызовов функций к TourVisor клиенту"""
+    async def _fn_get_current_date(self, args: Dict) -> Any:
+        """Текущая дата и время (для расчёта datefrom/dateto)"""
+        now = _dt.now()
+        return {
+            "date": _tv_date(now),
+            "time": f"{now.hour:02d}:{now.minute:02d}",
+            "year": now.year,
+            "month": now.month,
+            "day": now.day,
+            "weekday": _WEEKDAYS_RU[now.weekday()],
+            "hint": "Используй эту дату для datefrom/dateto. Формат: ДД.ММ.ГГГГ"
+        }
+    
+    async def _fn_search_tours(self, args: Dict) -> Any:
+        """Запуск поиска туров с валидацией параметров и каскада"""
+        # Запоминаем город вылета для маппинга tour_cards
+        dep_code = args.get("departure")
+        if dep_code is not None:
+            self._last_departure_city = _DEPARTURE_CITIES.get(
+                _safe_int(dep_code), self._last_departure_city
+            )
         
-        if name == "get_current_date":
-            from datetime import datetime
-            now = datetime.now()
-            return {
-                "date": now.strftime("%d.%m.%Y"),
-                "time": now.strftime("%H:%M"),
-                "year": now.year,
-                "month": now.month,
-                "day": now.day,
-                "weekday": ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота", "Воскресенье"][now.weekday()],
-                "hint": "Используй эту дату для datefrom/dateto. Формат: ДД.ММ.ГГГГ"
-            }
+        # Блокирующие проверки (курорт без региона, неполный каскад) идут ПЕРВЫМИ:
+        # если вызов всё равно будет отклонён, коррекция дат и ночей не нужна.
         
-        elif name == "search_tours":
-            # Запоминаем город вылета для маппинга tour_cards
-            dep_code = args.get("departure")
-            if dep_code is not None:
-                self._last_departure_city = _DEPARTURE_CITIES.get(
-                    _safe_int(dep_code), self._last_departure_city
-                )
-            
-            # ── Валидация и авто-коррекция dateto (Fix 1B) ──
-            datefrom_str = args.get("datefrom")
-            dateto_str = args.get("dateto")
-            nightsfrom = args.get("nightsfrom")
-            nightsto = args.get("nightsto")
-            
-            if datefrom_str:
-                try:
-                    datefrom_dt = _dt.strptime(datefrom_str, "%d.%m.%Y")
-                    dateto_dt = _dt.strptime(dateto_str, "%d.%m.%Y") if dateto_str else None
-                    
-                    has_specific_nights = nightsfrom is not None or nightsto is not None
-                    
-                    # Случай 1: dateto не указан → авто-установка datefrom + 2
-                    if dateto_dt is None:
-                        dateto_dt = datefrom_dt + _td(days=2)
-                        args["dateto"] = dateto_dt.strftime("%d.%m.%Y")
-                        logger.warning("⚠️ dateto не указан, установлен = datefrom+2 (%s)", args["dateto"])
-                    
-                    # Случай 2: dateto == datefrom (слишком узкий) → расширяем до +2
-                    elif dateto_dt == datefrom_dt:
-                        dateto_dt = datefrom_dt + _td(days=2)
-                        args["dateto"] = dateto_dt.strftime("%d.%m.%Y")
-                        logger.warning("⚠️ dateto == datefrom, расширен до datefrom+2 (%s)", args["dateto"])
-                    
-                    # Случай 3: конкретная дата + длительность, но dateto слишком далеко
-                    # Если nightsfrom/nightsto указаны и dateto - datefrom > nightsto,
-                    # значит модель интерпретировала dateto как дату окончания тура,
-                    # а не как последнюю дату вылета. Clamp до datefrom + 2.
-                    elif has_specific_nights and dateto_dt is not None:
-                        delta_days = (dateto_dt - datefrom_dt).days
-                        effective_nights = nightsto or nightsfrom or 7
-                        # Если диапазон дат > 3 дней и при этом примерно равен длительности ночей —
-                        # это ошибка модели (она посчитала dateto = datefrom + nights)
-                        if delta_days >= 4 and abs(delta_days - effective_nights) <= 2:
-                            corrected_dt = datefrom_dt + _td(days=2)
-                            self._metrics["dateto_corrections"] += 1
-                            logger.warning(
-                                "⚠️ dateto clamp: модель выставила dateto=%s (datefrom+%d дней ≈ nights=%d). "
-                                "Исправлено на datefrom+2 = %s (это окно дат ВЫЛЕТА, не дата возвращения!)",
-                                dateto_str, delta_days, effective_nights,
-                                corrected_dt.strftime("%d.%m.%Y")
-                            )
-                            args["dateto"] = corrected_dt.strftime("%d.%m.%Y")
-                    
-                    # ── Fix P6: Проверка дат в прошлом ──
-                    # Если datefrom уже в прошлом — сдвигаем на завтра
-                    now_dt = _dt.now().replace(hour=0, minute=0, second=0, microsecond=0)
-                    datefrom_dt = _dt.strptime(args["datefrom"], "%d.%m.%Y")  # Re-parse after possible clamp
-                    dateto_dt = _dt.strptime(args["dateto"], "%d.%m.%Y")
-                    
-                    if datefrom_dt < now_dt:
-                        new_datefrom = now_dt + _td(days=1)
-                        logger.warning(
-                            "⚠️ datefrom в прошлом (%s < %s), сдвинут на %s",
-                            args["datefrom"], now_dt.strftime("%d.%m.%Y"),
-                            new_datefrom.strftime("%d.%m.%Y")
-                        )
-                        args["datefrom"] = new_datefrom.strftime("%d.%m.%Y")
-                        # Если dateto тоже в прошлом — сдвигаем и его
-                        if dateto_dt < new_datefrom:
-                            new_dateto = new_datefrom + _td(days=2)
-                            args["dateto"] = new_dateto.strftime("%d.%m.%Y")
-                            logger.warning("⚠️ dateto тоже сдвинут на %s", args["dateto"])
-                    
-                except (ValueError, TypeError) as e:
-                    logger.warning("⚠️ Ошибка парсинга дат для валидации dateto: %s", e)
+        # ── Fix P3: Проверка региона/курорта ──
+        # Если клиент указал конкретный курорт, но модель НЕ передала regions —
+        # возвращаем ошибку с инструкцией определить регион
+        if not args.get("regions") and not args.get("subregions") and not args.get("hotels"):
+            user_messages_for_region = [
+                msg.get("content", "") for msg in self.full_history[-20:] 
+                if msg.get("role") == "user" and msg.get("content")
+            ]
+            user_text_for_region = " ".join(user_messages_for_region).lower()
             
-            # ── Fix P3: Проверка региона/курорта ──
-            # Если клиент указал конкретный курорт, но модель НЕ передала regions —
-            # возвращаем ошибку с инструкцией определить регион
-            if not args.get("regions") and not args.get("subregions") and not args.get("hotels"):
-                user_messages_for_region = [
-                    msg.get("content", "") for msg in self.full_history[-20:] 
-                    if msg.get("role") == "user" and msg.get("content")
-                ]
-                user_text_for_region = " ".join(user_messages_for_region).lower()
-                
-                # Универсальный список курортов по странам
-                # Формат: (паттерн, страна_для_подсказки)
-                resort_patterns = [
-                    # Россия (country=47)
-                    (r'\b(?:кисловодск|пятигорск|ессентуки|железноводск|минеральн\w*\s*вод)\b', "России"),
-                    (r'\b(?:сочи|адлер|красн\w*\s*полян)\b', "России"),
-                    (r'\b(?:анап[аыуе]|геленджик|новоросс)\b', "России"),
-                    (r'\b(?:крым|ялт[аыуе]|алушт[аыуе]|севастопол|феодоси|судак|евпатори)\b', "России"),
-                    (r'\b(?:калининград|светлогорск|зеленоградск)\b', "России"),
-                    # Таиланд (country=2)
-                    (r'\b(?:пхукет|пукет)\b', "Таиланда"),
-                    (r'\b(?:паттай[яеу]|паттая)\b', "Таиланда"),
-                    (r'\b(?:самуи)\b', "Таиланда"),
-                    (r'\b(?:краби)\b', "Таиланда"),
-                    (r'\b(?:хуа\s*хин)\b', "Таиланда"),
-                    # Турция (country=4) 
-                    (r'\b(?:алан[ьи]я|аланья)\b', "Турции"),
-                    (r'\b(?:анталь?я|анталия)\b', "Турции"),
-                    (r'\b(?:кемер)\b', "Турции"),
-                    (r'\b(?:сиде)\b', "Турции"),
-                    (r'\b(?:белек)\b', "Турции"),
-                    (r'\b(?:бодрум)\b', "Турции"),
-                    (r'\b(?:мармарис)\b', "Турции"),
-                    (r'\b(?:фетхие|фетие)\b', "Турции"),
-                    (r'\b(?:кушадас)\b', "Турции"),
-                    (r'\b(?:стамбул)\b', "Турции"),
-                    # Египет (country=1)
-                    (r'\b(?:шарм|шарм-эль-шейх|шарм\s*эль\s*шейх)\b', "Египта"),
-                    (r'\b(?:хургад[аыуе])\b', "Египта"),
-                    (r'\b(?:марса\s*алам)\b', "Египта"),
-                    (r'\b(?:дахаб)\b', "Египта"),
-                    # ОАЭ (country=9)
-                    (r'\b(?:дубай|дубаи)\b', "ОАЭ"),
-                    (r'\b(?:абу[\s-]*даби)\b', "ОАЭ"),
-                    (r'\b(?:шардж[аеу])\b', "ОАЭ"),
-                    (r'\b(?:рас[\s-]*аль[\s-]*хайм)\b', "ОАЭ"),
-                    # Вьетнам (country=16)
-                    (r'\b(?:фукуок|фу\s*куок)\b', "Вьетнама"),
-                    (r'\b(?:нячанг|ня\s*чанг)\b', "Вьетнама"),
-                    (r'\b(?:фантьет|фан\s*тьет|муйне|муй\s*не)\b', "Вьетнама"),
-                    # Шри-Ланка
-                    (r'\b(?:коломбо|бентот[аы]|хиккадув[аы]|унаватун[аы])\b', "Шри-Ланки"),
-                    # Мальдивы
-                    (r'\b(?:мале|маафуш)\b', "Мальдив"),
-                    # Куба
-                    (r'\b(?:варадеро|гаван[аы])\b', "Кубы"),
-                    # Доминикана
-                    (r'\b(?:пунта[\s-]*кан[аы]|бока[\s-]*чик[аы])\b', "Доминиканы"),
-                ]
-                
-                mentioned_resort = None
-                for pattern, country_name in resort_patterns:
-                    if re.search(pattern, user_text_for_region):
-                        mentioned_resort = (re.search(pattern, user_text_for_region).group(), country_name)
+            mentioned_resort = None
+            if _RESORT_ANY_RE.search(user_text_for_region):
+                for pattern, country_name in _RESORT_PATTERNS:
+                    m = pattern.search(user_text_for_region)
+                    if m:
+                        mentioned_resort = (m.group(), country_name)
                         break
-                
-                if mentioned_resort:
-                    resort_name, country_name = mentioned_resort
-                    self._metrics.setdefault("resort_without_region_detections", 0)
-                    self._metrics["resort_without_region_detections"] += 1
-                    logger.warning(
-                        "⚠️ RESORT-WITHOUT-REGION: клиент указал курорт '%s' (%s), но модель НЕ передала regions — блокируем",
-                        resort_name, country_name
-                    )
-                    country_code = args.get("country", "")
-                    return {
-                        "status": "error",
-                        "error": (
-                            f"СИСТЕМНАЯ ОШИБКА: Клиент указал конкретный курорт '{resort_name}', "
-                            f"но ты НЕ передал параметр regions в search_tours! "
-                            f"ОБЯЗАТЕЛЬНО определи код региона: вызови get_dictionaries(type='region', regcountry={country_code}) "
-                            f"и найди код для '{resort_name}'. Затем передай regions=КОД в search_tours. "
-                            f"Без regions поиск вернёт туры по ВСЕЙ стране, а не по указанному курорту!"
-                        ),
-                        "_hint": f"Определи код региона '{resort_name}' через get_dictionaries и передай в regions."
-                    }
-            
-            # ── Проверка полноты каскада (Fix 3B — блокирующая проверка) ──
-            # Анализируем историю диалога, чтобы убедиться, что клиент ЯВНО указал критичные слоты
-            is_cascade_complete, missing_slots = _check_cascade_slots(self.full_history, args)
             
-            if not is_cascade_complete:
-                self._metrics["cascade_incomplete_detections"] += 1
+            if mentioned_resort:
+                resort_name, country_name = mentioned_resort
+                self._metrics.setdefault("resort_without_region_detections", 0)
+                self._metrics["resort_without_region_detections"] += 1
                 logger.warning(
-                    "⚠️ CASCADE-INCOMPLETE: клиент НЕ указал %s — блокируем search_tours и nudge модель",
-                    ", ".join(missing_slots)
+                    "⚠️ RESORT-WITHOUT-REGION: клиент указал курорт '%s' (%s), но модель НЕ передала regions — блокируем",
+                    resort_name, country_name
                 )
-                # Возвращаем ошибку с ОДНИМ приоритетным вопросом (по порядку каскада: 2→3→4→5)
-                # Правило § 0.3: "задавай ОДИН чёткий вопрос", не анкету
-                first_missing = missing_slots[0]  # Берём первый по приоритету
-                
-                nudge_map = {
-                    "город вылета": "'Из какого города планируете вылет?'",
-                    "даты/месяц и длительность": "'Когда планируете поездку и на сколько ночей?'",
-                    "даты/месяц вылета": "'В каком месяце планируете вылет?'",
-                    "состав путешественников": "'Сколько взрослых едет и будут ли с вами дети?'",
-                    "категорию отеля и тип питания (Quality Check)": "'Какую категорию отеля и тип питания предпочитаете?'",
-                }
-                nudge = nudge_map.get(first_missing, f"Уточни у клиента: {first_missing}")
-                
+                country_code = args.get("country", "")
                 return {
                     "status": "error",
-                    "error": (
-                        f"СИСТЕМНАЯ ОШИБКА ВАЛИДАЦИИ КАСКАДА: Клиент НЕ указал {first_missing}! "
-                        f"ОБЯЗАТЕЛЬНО спроси клиента ЯВНО: {nudge}. "
-                        f"Задай ТОЛЬКО ОДИН вопрос, не перечисляй список! "
-                        f"НЕ вызывай search_tours пока клиент не ответит!"
-                    ),
-                    "_hint": "Это защита от пропуска слотов каскада. Спроси ОДИН вопрос о недостающих данных."
+                    "error": _RESORT_NO_REGION_ERROR.format(resort=resort_name, country=country_code),
+                    "_hint": _RESORT_NO_REGION_HINT.format(resort=resort_name)
                 }
-            
-            # ── Fix P5: Авто-коррекция nightsfrom (минимум 3 ночи) ──
-            # По бизнес-логике nightsfrom < 3 бессмысленно (нет туров на 1-2 ночи)
-            # Также если nightsfrom > nightsto — исправляем (nightsfrom = nightsto)
-            nf = args.get("nightsfrom")
-            nt = args.get("nightsto")
-            if nf is not None and nf < 3:
-                logger.warning("⚠️ nightsfrom=%d < 3, исправлено на 3 (минимум для туров)", nf)
-                args["nightsfrom"] = 3
-            if nf is not None and nt is not None and nf > nt:
-                logger.warning("⚠️ nightsfrom=%d > nightsto=%d, исправлено nightsfrom=%d", nf, nt, nt)
-                args["nightsfrom"] = nt
-            
-            # ── Логирование пропущенных ключевых параметров (информационное) ──
-            missing_params = []
-            if not args.get("adults"):
-                missing_params.append("adults")
-            if not args.get("datefrom"):
-                missing_params.append("datefrom")
-            if not args.get("dateto"):
-                missing_params.append("dateto")
-            if not args.get("stars"):
-                missing_params.append("stars")
-            if not args.get("meal"):
-                missing_params.append("meal")
-            
-            if missing_params:
-                logger.info(
-                    "ℹ️ search_tours вызван с дефолтными параметрами: %s",
-                    ", ".join(missing_params)
-                )
-            
-            self._metrics["total_searches"] += 1
-            request_id = await self.tourvisor.search_tours(
-                departure=args.get("departure"),
-                country=args.get("country"),
-                date_from=args.get("datefrom"),
-                date_to=args.get("dateto"),
-                nights_from=args.get("nightsfrom", 7),
-                nights_to=args.get("nightsto", 10),
-                adults=args.get("adults", 2),
-                children=args.get("child", 0),
-                child_ages=[args.get(f"childage{i}") for i in [1,2,3] if args.get(f"childage{i}")],
-                stars=args.get("stars"),
-                meal=args.get("meal"),
-                rating=args.get("rating"),
-                hotels=args.get("hotels"),
-                regions=args.get("regions"),
-                subregions=args.get("subregions"),
-                operators=args.get("operators"),
-                price_from=args.get("pricefrom"),
-                price_to=args.get("priceto"),
-                hotel_types=args.get("hoteltypes"),
-                services=args.get("services"),
-                onrequest=args.get("onrequest"),
-                directflight=args.get("directflight"),
-                flightclass=args.get("flightclass"),
-                currency=args.get("currency"),
-                pricetype=args.get("pricetype"),
-                starsbetter=args.get("starsbetter"),
-                mealbetter=args.get("mealbetter"),
-                hideregular=args.get("hideregular")
+        
+        # ── Проверка полноты каскада (Fix 3B — блокирующая проверка) ──
+        # Анализируем историю диалога, чтобы убедиться, что клиент ЯВНО указал критичные слоты
+        # Когда каскад однажды пройден, слоты уже известны — не сканируем историю заново.
+        # Нужен только первый пропущенный слот — генератор останавливается на нём.
+        first_missing = None
+        if not self._cascade_passed:
+            first_missing = next(_iter_missing_cascade_slots(self.full_history), None)
+            self._cascade_passed = first_missing is None
+        
+        if first_missing is not None:
+            self._metrics["cascade_incomplete_detections"] += 1
+            logger.warning(
+                "⚠️ CASCADE-INCOMPLETE: клиент НЕ указал %s — блокируем search_tours и nudge модель",
+                first_missing
             )
+            # Возвращаем ошибку с ОДНИМ приоритетным вопросом (по порядку каскада: 2→3→4→5)
+            # Правило § 0.3: "задавай ОДИН чёткий вопрос", не анкету
+            nudge = _CASCADE_NUDGES.get(first_missing) or f"Уточни у клиента: {first_missing}"
             
-            # Проверка на ошибку (прошлые даты и т.п.)
-            if request_id is None:
-                return {
-                    "error": "Не удалось создать поиск. Проверьте даты — они должны быть в будущем (2026 год или позже).",
-                    "hint": "Используйте формат ДД.ММ.ГГГГ, например 01.03.2026"
-                }
-            
-            return {"requestid": str(request_id), "message": "Поиск запущен. Вызови get_search_status — он автоматически дождётся результатов. Затем get_search_results."}
-        
-        elif name == "get_search_status":
-            # ⚡ КРИТИЧЕСКИ ВАЖНО: Внутренний polling с ожиданием!
-            # Без этого AI вызывает get_search_status в цикле и сжигает все итерации.
-            # Теперь ОДНА итерация AI = полное ожидание завершения поиска.
-            request_id = args["requestid"]
-            max_wait = 60  # Максимум ожидания в секундах
-            poll_interval = 3  # Интервал опроса
-            elapsed = 0
-            last_status = {}
-            
-            while elapsed < max_wait:
-                last_status = await self.tourvisor.get_search_status(request_id)
-                state = last_status.get("state")
+            return {
+                "status": "error",
+                "error": _CASCADE_INCOMPLETE_ERROR.format(slot=first_missing, nudge=nudge),
+                "_hint": "Это защита от пропуска слотов каскада. Спроси ОДИН вопрос о недостающих данных."
+            }
+        
+        # ── Валидация и авто-коррекция dateto (Fix 1B) ──
+        datefrom_str = args.get("datefrom")
+        dateto_str = args.get("dateto")
+        nightsfrom = args.get("nightsfrom")
+        nightsto = args.get("nightsto")
+        
+        if datefrom_str:
+            try:
+                datefrom_dt = _dt.strptime(datefrom_str, _TV_DATE_FMT)
+                dateto_dt = _dt.strptime(dateto_str, _TV_DATE_FMT) if dateto_str else None
+                
+                has_specific_nights = nightsfrom is not None or nightsto is not None
                 
-                if state == "finished":
-                    # Проверяем есть ли результаты
-                    hotels_found = last_status.get("hotelsfound", 0)
-                    tours_found = last_status.get("toursfound", 0)
-
-                    if hotels_found == 0 or tours_found == 0:
-                        raise NoResultsError(
-                            f"Поиск завершён: найдено {hotels_found} отелей, {tours_found} туров",
-                            filters_hint="Попробуйте расширить даты, увеличить бюджет или убрать фильтры"
+                # Случай 1: dateto не указан → авто-установка datefrom + 2
+                if dateto_dt is None:
+                    dateto_dt = datefrom_dt + _DEPARTURE_WINDOW
+                    args["dateto"] = _tv_date(dateto_dt)
+                    logger.warning("⚠️ dateto не указан, установлен = datefrom+2 (%s)", args["dateto"])
+                
+                # Случай 2: dateto == datefrom (слишком узкий) → расширяем до +2
+                elif dateto_dt == datefrom_dt:
+                    dateto_dt = datefrom_dt + _DEPARTURE_WINDOW
+                    args["dateto"] = _tv_date(dateto_dt)
+                    logger.warning("⚠️ dateto == datefrom, расширен до datefrom+2 (%s)", args["dateto"])
+                
+                # Случай 3: конкретная дата + длительность, но dateto слишком далеко
+                # Если nightsfrom/nightsto указаны и dateto - datefrom > nightsto,
+                # значит модель интерпретировала dateto как дату окончания тура,
+                # а не как последнюю дату вылета. Clamp до datefrom + 2.
+                elif has_specific_nights and dateto_dt is not None:
+                    delta_days = (dateto_dt - datefrom_dt).days
+                    effective_nights = nightsto or nightsfrom or 7
+                    # Если диапазон дат > 3 дней и при этом примерно равен длительности ночей —
+                    # это ошибка модели (она посчитала dateto = datefrom + nights)
+                    if delta_days >= 4 and abs(delta_days - effective_nights) <= 2:
+                        corrected_dt = datefrom_dt + _DEPARTURE_WINDOW
+                        # Блокирующие проверки уже пройдены — считаем только коррекции
+                        # в вызовах, которые действительно уйдут в поиск
+                        self._metrics["dateto_corrections"] += 1
+                        logger.warning(
+                            "⚠️ dateto clamp: модель выставила dateto=%s (datefrom+%d дней ≈ nights=%d). "
+                            "Исправлено на datefrom+2 = %s (это окно дат ВЫЛЕТА, не дата возвращения!)",
+                            dateto_str, delta_days, effective_nights,
+                            _tv_date(corrected_dt)
                         )
-
-                    last_status["_hint"] = (
-                        f"Поиск завершён! Найдено {hotels_found} отелей, {tours_found} туров. "
-                        f"Вызови get_search_results с requestid для получения списка отелей."
-                    )
-                    return last_status
+                        dateto_dt = corrected_dt
+                        args["dateto"] = _tv_date(corrected_dt)
                 
-                if state == "no search results":
-                    last_status["_hint"] = "Поиск не найден. requestid недействителен — нужен новый поиск."
-                    return last_status
+                # ── Fix P6: Проверка дат в прошлом ──
+                # Если datefrom уже в прошлом — сдвигаем на завтра
+                # datefrom_dt/dateto_dt уже актуальны после коррекций выше — повторный парсинг не нужен
+                now_dt = _dt.now().replace(hour=0, minute=0, second=0, microsecond=0)
                 
-                # Если уже есть достаточно результатов (>5 отелей) и прогресс >40% —
-                # можно забирать частичные результаты, не ждать 100%
-                hotels_found = last_status.get("hotelsfound", 0)
-                progress = last_status.get("progress", 0)
-                if hotels_found >= 5 and progress >= 40:
-                    logger.info("📊 SEARCH READY (partial)  requestid=%s  progress=%s%%  hotels=%s — returning early",
-                                request_id, progress, hotels_found)
-                    last_status["_hint"] = (
-                        f"Поиск ещё идёт ({progress}%), но уже найдено {hotels_found} отелей. "
-                        f"Вызови get_search_results с этим requestid для показа результатов."
+                if datefrom_dt < now_dt:
+                    new_datefrom = now_dt + _ONE_DAY
+                    logger.warning(
+                        "⚠️ datefrom в прошлом (%s < %s), сдвинут на %s",
+                        args["datefrom"], _tv_date(now_dt),
+                        _tv_date(new_datefrom)
                     )
-                    return last_status
+                    args["datefrom"] = _tv_date(new_datefrom)
+                    # Если dateto тоже в прошлом — сдвигаем и его
+                    if dateto_dt < new_datefrom:
+                        new_dateto = new_datefrom + _DEPARTURE_WINDOW
+                        args["dateto"] = _tv_date(new_dateto)
+                        logger.warning("⚠️ dateto тоже сдвинут на %s", args["dateto"])
                 
-                # Ждём перед следующим опросом
-                logger.debug("📊 SEARCH WAITING  requestid=%s  progress=%s%%  hotels=%s  elapsed=%ds  sleeping %ds…",
-                            request_id, progress, hotels_found, elapsed, poll_interval)
-                await asyncio.sleep(poll_interval)
-                elapsed += poll_interval
-            
-            # Timeout — возвращаем что есть
-            hotels_found = last_status.get("hotelsfound", 0)
-            if hotels_found > 0:
-                last_status["_hint"] = (
-                    f"Поиск не завершился за {max_wait}с, но найдено {hotels_found} отелей. "
-                    f"Вызови get_search_results для показа частичных результатов."
-                )
-            else:
-                last_status["_hint"] = (
-                    f"Поиск не завершился за {max_wait}с и результатов нет. "
-                    f"Предложи клиенту изменить параметры (даты, бюджет, направление)."
-                )
-            return last_status
-        
-        elif name == "get_search_results":
-            full_results = await self.tourvisor.get_search_results(
-                request_id=args["requestid"],
-                page=args.get("page", 1),
-                per_page=args.get("onpage", 10),  # Ограничиваем до 10 отелей
-                include_operators=args.get("operatorstatus") == 1,
-                no_description=args.get("nodescription") == 1
+            except (ValueError, TypeError) as e:
+                logger.warning("⚠️ Ошибка парсинга дат для валидации dateto: %s", e)
+        
+        # ── Fix P5: Авто-коррекция nightsfrom (минимум 3 ночи) ──
+        # По бизнес-логике nightsfrom < 3 бессмысленно (нет туров на 1-2 ночи)
+        # Также если nightsfrom > nightsto — исправляем (nightsfrom = nightsto)
+        nf = args.get("nightsfrom")
+        nt = args.get("nightsto")
+        if nf is not None and nf < 3:
+            logger.warning("⚠️ nightsfrom=%d < 3, исправлено на 3 (минимум для туров)", nf)
+            args["nightsfrom"] = 3
+        if nf is not None and nt is not None and nf > nt:
+            logger.warning("⚠️ nightsfrom=%d > nightsto=%d, исправлено nightsfrom=%d", nf, nt, nt)
+            args["nightsfrom"] = nt
+        
+        # ── Логирование пропущенных ключевых параметров (информационное) ──
+        missing_params = [p for p in _SEARCH_KEY_PARAMS if not args.get(p)]
+        
+        if missing_params:
+            logger.info(
+                "ℹ️ search_tours вызван с дефолтными параметрами: %s",
+                ", ".join(missing_params)
             )
-            
-            # Сокращаем результаты для AI — формат карточек с картинками
-            hotels = full_results.get("result", {}).get("hotel", [])
-            simplified = []
-            for h in hotels[:5]:  # Максимум 5 отелей для AI
-                tours = h.get("tours", {}).get("tour", [])
-                best_tour = tours[0] if tours else {}
-                
-                # Проверяем картинку — не показываем заглушки регионов
-                picture = h.get("picturelink", "")
-                has_real_photo = h.get("isphoto") == 1 and picture and "/reg-" not in picture
-                
-                simplified.append({
-                    "hotelcode": h.get("hotelcode"),
-                    "hotelname": h.get("hotelname"),
-                    "hotelstars": h.get("hotelstars"),
-                    "hotelrating": h.get("hotelrating"),
-                    "regionname": h.get("regionname"),
-                    "countryname": h.get("countryname"),
-                    "price": h.get("price"),
-                    "seadistance": h.get("seadistance"),
-                    "picturelink": picture if has_real_photo else None,  # Только реальные фото
-                    "hoteldescription": h.get("hoteldescription"),  # Описание
-                    "fulldesclink": h.get("fulldesclink"),  # Ссылка на подробности
-                    "tour": {
-                        "tourid": best_tour.get("tourid"),
-                        "price": best_tour.get("price"),  # Цена конкретного тура
-                        "flydate": best_tour.get("flydate"),
-                        "nights": best_tour.get("nights"),
-                        "meal": best_tour.get("mealrussian"),
-                        "room": best_tour.get("room"),
-                        "placement": best_tour.get("placement"),
-                        "operatorname": best_tour.get("operatorname"),
-                        "tourname": best_tour.get("tourname"),  # Название тура
-                        # ⚠️ Важные статусы для предупреждений клиенту:
-                        "promo": best_tour.get("promo"),
-                        "regular": best_tour.get("regular"),
-                        "onrequest": best_tour.get("onrequest"),
-                        "flightstatus": best_tour.get("flightstatus"),
-                        "hotelstatus": best_tour.get("hotelstatus"),
-                        "nightflight": best_tour.get("nightflight"),
-                        # ⚠️ Важные флаги об исключениях из тура:
-                        "noflight": best_tour.get("noflight"),
-                        "notransfer": best_tour.get("notransfer"),
-                        "nomedinsurance": best_tour.get("nomedinsurance"),
-                        "nomeal": best_tour.get("nomeal")
-                    } if best_tour else None
-                })
-            
-            # ── Строим tour_cards для нового фронтенда ──
-            self._pending_tour_cards = [
-                _map_hotel_to_card(h, self._last_departure_city)
-                for h in simplified
-            ]
-            logger.info("🎴 Built %d tour cards for frontend", len(self._pending_tour_cards))
-            
-            status = full_results.get("status", {})
-
-            # ── Сокращённые данные для AI (без описаний/цен/дат — они на карточках) ──
-            ai_hotels = []
-            for h in simplified:
-                tour = h.get("tour") or {}
-                warnings = []
-                if tour.get("nightflight"):
-                    warnings.append("ночной перелёт")
-                if tour.get("noflight"):
-                    warnings.append("без перелёта")
-                if tour.get("notransfer"):
-                    warnings.append("без трансфера")
-                if tour.get("nomedinsurance"):
-                    warnings.append("без мед.страховки")
-                if tour.get("nomeal"):
-                    warnings.append("без питания")
-                if tour.get("onrequest"):
-                    warnings.append("под запрос")
-                entry = {
-                    "hotelcode": h.get("hotelcode"),
-                    "hotelname": h.get("hotelname"),
-                }
-                if warnings:
-                    entry["warnings"] = warnings
-                ai_hotels.append(entry)
-
+        
+        self._metrics["total_searches"] += 1
+        request_id = await self.tourvisor.search_tours(
+            departure=args.get("departure"),
+            country=args.get("country"),
+            date_from=args.get("datefrom"),
+            date_to=args.get("dateto"),
+            nights_from=args.get("nightsfrom", 7),
+            nights_to=args.get("nightsto", 10),
+            adults=args.get("adults", 2),
+            children=args.get("child", 0),
+            child_ages=[age for key in _CHILD_AGE_KEYS if (age := args.get(key))],
+            stars=args.get("stars"),
+            meal=args.get("meal"),
+            rating=args.get("rating"),
+            hotels=args.get("hotels"),
+            regions=args.get("regions"),
+            subregions=args.get("subregions"),
+            operators=args.get("operators"),
+            price_from=args.get("pricefrom"),
+            price_to=args.get("priceto"),
+            hotel_types=args.get("hoteltypes"),
+            services=args.get("services"),
+            onrequest=args.get("onrequest"),
+            directflight=args.get("directflight"),
+            flightclass=args.get("flightclass"),
+            currency=args.get("currency"),
+            pricetype=args.get("pricetype"),
+            starsbetter=args.get("starsbetter"),
+            mealbetter=args.get("mealbetter"),
+            hideregular=args.get("hideregular")
+        )
+        
+        # Проверка на ошибку (прошлые даты и т.п.)
+        if request_id is None:
             return {
-                "hotels_found": status.get("hotelsfound", len(hotels)),
-                "tours_found": status.get("toursfound", 0),
-                "hotels": ai_hotels,
-                "_hint": "Карточки с фото, ценами, датами, питанием, звёздами УЖЕ отображены фронтендом. НЕ перечисляй отели, цены, описания, даты, питание, звёзды в тексте! Напиши ТОЛЬКО краткий комментарий (1-2 предложения) и спроси клиента."
+                "error": "Не удалось создать поиск. Проверьте даты — они должны быть в будущем (2026 год или позже).",
+                "hint": "Используйте формат ДД.ММ.ГГГГ, например 01.03.2026"
             }
         
-        elif name == "get_dictionaries":
-            # Определяем какой справочник запрашивается
-            dict_type = args.get("type", "")
+        return {"requestid": str(request_id), "message": "Поиск запущен. Вызови get_search_status — он автоматически дождётся результатов. Затем get_search_results."}
+    
+    async def _fn_get_search_status(self, args: Dict) -> Any:
+        """Ожидание завершения поиска (внутренний polling)"""
+        # ⚡ КРИТИЧЕСКИ ВАЖНО: Внутренний polling с ожиданием!
+        # Без этого AI вызывает get_search_status в цикле и сжигает все итерации.
+        # Теперь ОДНА итерация AI = полное ожидание завершения поиска.
+        request_id = args["requestid"]
+        max_wait = 60  # Максимум ожидания в секундах
+        max_poll_interval = 3  # Максимальный интервал опроса (от 2 с, см. next_poll_delay)
+        started = time.monotonic()  # elapsed — реальное время, включая сами запросы
+        elapsed = 0.0
+        attempt = 0
+        last_status = {}
+        await self.tourvisor.wait_first_poll(request_id)
+        
+        while elapsed < max_wait:
+            last_status = await self.tourvisor.get_search_status(request_id)
+            state = last_status.get("state")
             
-            if "departure" in dict_type:
-                return await self.tourvisor.get_departures()
-            elif "country" in dict_type:
-                return await self.tourvisor.get_countries(args.get("cndep"))
-            elif "subregion" in dict_type:
-                return await self.tourvisor.get_subregions(args.get("regcountry"))
-            elif "region" in dict_type:
-                return await self.tourvisor.get_regions(args.get("regcountry"))
-            elif "meal" in dict_type:
-                return await self.tourvisor.get_meals()
-            elif "stars" in dict_type:
-                return await self.tourvisor.get_stars()
-            elif "operator" in dict_type:
-                return await self.tourvisor.get_operators(
-                    args.get("flydeparture"),
-                    args.get("flycountry")
-                )
-            elif "services" in dict_type:
-                return await self.tourvisor.get_services()
-            elif "flydate" in dict_type:
-                return await self.tourvisor.get_flydates(
-                    args.get("flydeparture"),
-                    args.get("flycountry")
+            if state == "finished":
+                # Проверяем есть ли результаты
+                hotels_found = last_status.get("hotelsfound", 0)
+                tours_found = last_status.get("toursfound", 0)
+
+                if hotels_found == 0 or tours_found == 0:
+                    raise NoResultsError(
+                        f"Поиск завершён: найдено {hotels_found} отелей, {tours_found} туров",
+                        filters_hint="Попробуйте расширить даты, увеличить бюджет или убрать фильтры"
+                    )
+
+                last_status["_hint"] = (
+                    f"Поиск завершён! Найдено {hotels_found} отелей, {tours_found} туров. "
+                    f"Вызови get_search_results с requestid для получения списка отелей."
                 )
-            elif "hotel" in dict_type:
-                # Собираем типы отелей
-                hotel_types = []
-                for ht in ["active", "relax", "family", "health", "city", "beach", "deluxe"]:
-                    if args.get(f"hot{ht}") == 1:
-                        hotel_types.append(ht)
-                
-                hotels = await self.tourvisor.get_hotels(
-                    country_id=args.get("hotcountry"),
-                    region_id=args.get("hotregion"),
-                    stars=args.get("hotstars"),
-                    rating=args.get("hotrating"),
-                    hotel_types=hotel_types if hotel_types else None
+                return last_status
+            
+            if state == "no search results":
+                last_status["_hint"] = "Поиск не найден. requestid недействителен — нужен новый поиск."
+                return last_status
+            
+            # Если уже есть достаточно результатов (>5 отелей) и прогресс >40% —
+            # можно забирать частичные результаты, не ждать 100%
+            hotels_found = last_status.get("hotelsfound", 0)
+            progress = last_status.get("progress", 0)
+            if hotels_found >= 5 and progress >= 40:
+                logger.info("📊 SEARCH READY (partial)  requestid=%s  progress=%s%%  hotels=%s — returning early",
+                            request_id, progress, hotels_found)
+                last_status["_hint"] = (
+                    f"Поиск ещё идёт ({progress}%), но уже найдено {hotels_found} отелей. "
+                    f"Вызови get_search_results с этим requestid для показа результатов."
                 )
-                # Фильтруем по названию если указано
-                name_filter = args.get("name", "").lower()
-                if name_filter:
-                    hotels = [h for h in hotels if name_filter in h.get("name", "").lower()]
-                return hotels[:20]  # Максимум 20 отелей
-            elif "currency" in dict_type:
-                # Курсы валют туроператоров
-                return await self.tourvisor.get_currencies()
-            else:
-                return {"error": f"Неизвестный тип справочника: {dict_type}"}
-        
-        elif name == "actualize_tour":
-            return await self.tourvisor.actualize_tour(
-                tour_id=args["tourid"],
-                request_mode=args.get("request", 2),
-                currency=args.get("currency", 0)
+                return last_status
+            
+            # Ждём перед следующим опросом
+            poll_delay = next_poll_delay(attempt, max_poll_interval)
+            logger.debug("📊 SEARCH WAITING  requestid=%s  progress=%s%%  hotels=%s  elapsed=%.1fs  sleeping %.1fs…",
+                        request_id, progress, hotels_found, elapsed, poll_delay)
+            await asyncio.sleep(poll_delay)
+            elapsed = time.monotonic() - started
+            attempt += 1
+        
+        # Timeout — возвращаем что есть
+        hotels_found = last_status.get("hotelsfound", 0)
+        if hotels_found > 0:
+            last_status["_hint"] = (
+                f"Поиск не завершился за {max_wait}с, но найдено {hotels_found} отелей. "
+                f"Вызови get_search_results для показа частичных результатов."
             )
-        
-        elif name == "get_tour_details":
-            return await self.tourvisor.get_tour_details(
-                tour_id=args["tourid"],
-                currency=args.get("currency", 0)
+        else:
+            last_status["_hint"] = (
+                f"Поиск не завершился за {max_wait}с и результатов нет. "
+                f"Предложи клиенту изменить параметры (даты, бюджет, направление)."
             )
+        return last_status
+    
+    async def _fn_get_search_results(self, args: Dict) -> Any:
+        """Результаты поиска: tour_cards для фронтенда + краткий список для AI"""
+        full_results = await self.tourvisor.get_search_results(
+            request_id=args["requestid"],
+            page=args.get("page", 1),
+            per_page=args.get("onpage", 10),  # Ограничиваем до 10 отелей
+            include_operators=args.get("operatorstatus") == 1,
+            no_description=args.get("nodescription") == 1
+        )
         
-        elif name == "get_hotel_info":
-            hotel = await self.tourvisor.get_hotel_info(
-                hotel_code=args["hotelcode"],
-                big_images=True,  # Всегда большие картинки
-                remove_tags=True,  # Без HTML тегов
-                include_reviews=args.get("reviews") == 1
-            )
-            
-            # Форматируем для карточки с полным описанием
-            images = hotel.get("images", {})
-            if isinstance(images, dict):
-                images = images.get("image", [])
-            if isinstance(images, str):
-                images = [images]
+        # Сокращаем результаты для AI — формат карточек с картинками
+        hotels = full_results.get("result", {}).get("hotel", [])
+        simplified = []
+        for h in hotels[:5]:  # Максимум 5 отелей для AI
+            tours = h.get("tours", {}).get("tour", [])
+            best_tour = tours[0] if tours else {}
             
-            reviews = hotel.get("reviews", {})
-            if isinstance(reviews, dict):
-                reviews = reviews.get("review", [])
+            # Проверяем картинку — не показываем заглушки регионов
+            picture = _real_photo(h.get("picturelink")) if h.get("isphoto") == 1 else None
             
-            return {
-                "name": hotel.get("name"),
-                "stars": hotel.get("stars"),
-                "rating": hotel.get("rating"),
-                "country": hotel.get("country"),
-                "region": hotel.get("region"),
-                "placement": hotel.get("placement"),
-                "seadistance": hotel.get("seadistance"),
-                "build": hotel.get("build"),
-                "description": hotel.get("description"),
-                "territory": hotel.get("territory"),
-                "inroom": hotel.get("inroom"),
-                "roomtypes": hotel.get("roomtypes"),
-                "beach": hotel.get("beach"),
-                "child": hotel.get("child"),
-                "services": hotel.get("services"),
-                "servicefree": hotel.get("servicefree"),
-                "servicepay": hotel.get("servicepay"),
-                "meallist": hotel.get("meallist"),
-                "mealtypes": hotel.get("mealtypes"),
-                "animation": hotel.get("animation"),
-                "images": images[:5] if images else [],  # Первые 5 фото
-                "images_count": hotel.get("imagescount"),
-                "coordinates": {
-                    "lat": hotel.get("coord1"),
-                    "lon": hotel.get("coord2")
-                },
-                "reviews": [
-                    {
-                        "name": r.get("name"),
-                        "rate": r.get("rate"),
-                        "content": r.get("content", "")[:300] + "..." if len(r.get("content", "")) > 300 else r.get("content", ""),
-                        "traveltime": r.get("traveltime"),
-                        "sourcelink": r.get("sourcelink", "")  # ВАЖНО для указания источника!
-                    } for r in (reviews[:3] if reviews else [])
-                ] if args.get("reviews") == 1 else []
+            simplified.append({
+                "hotelcode": h.get("hotelcode"),
+                "hotelname": h.get("hotelname"),
+                "hotelstars": h.get("hotelstars"),
+                "hotelrating": h.get("hotelrating"),
+                "regionname": h.get("regionname"),
+                "countryname": h.get("countryname"),
+                "price": h.get("price"),
+                "seadistance": h.get("seadistance"),
+                "picturelink": picture,  # Только реальные фото
+                "hoteldescription": h.get("hoteldescription"),  # Описание
+                "fulldesclink": h.get("fulldesclink"),  # Ссылка на подробности
+                "tour": {
+                    "tourid": best_tour.get("tourid"),
+                    "price": best_tour.get("price"),  # Цена конкретного тура
+                    "flydate": best_tour.get("flydate"),
+                    "nights": best_tour.get("nights"),
+                    "meal": best_tour.get("mealrussian"),
+                    "room": best_tour.get("room"),
+                    "placement": best_tour.get("placement"),
+                    "operatorname": best_tour.get("operatorname"),
+                    "tourname": best_tour.get("tourname"),  # Название тура
+                    # ⚠️ Важные статусы для предупреждений клиенту:
+                    "promo": best_tour.get("promo"),
+                    "regular": best_tour.get("regular"),
+                    "onrequest": best_tour.get("onrequest"),
+                    "flightstatus": best_tour.get("flightstatus"),
+                    "hotelstatus": best_tour.get("hotelstatus"),
+                    "nightflight": best_tour.get("nightflight"),
+                    # ⚠️ Важные флаги об исключениях из тура:
+                    "noflight": best_tour.get("noflight"),
+                    "notransfer": best_tour.get("notransfer"),
+                    "nomedinsurance": best_tour.get("nomedinsurance"),
+                    "nomeal": best_tour.get("nomeal")
+                } if best_tour else None
+            })
+        
+        # ── Строим tour_cards для нового фронтенда ──
+        self._pending_tour_cards = [
+            _map_hotel_to_card(h, self._last_departure_city)
+            for h in simplified
+        ]
+        logger.info("🎴 Built %d tour cards for frontend", len(self._pending_tour_cards))
+        
+        status = full_results.get("status", {})
+
+        # ── Сокращённые данные для AI (без описаний/цен/дат — они на карточках) ──
+        ai_hotels = []
+        for h in simplified:
+            tour = h.get("tour") or {}
+            warnings = [label for flag, label in _TOUR_WARNING_FLAGS if tour.get(flag)]
+            entry = {
+                "hotelcode": h.get("hotelcode"),
+                "hotelname": h.get("hotelname"),
             }
-        
-        elif name == "get_hot_tours":
-            tours = await self.tourvisor.get_hot_tours(
-                city=args["city"],
-                count=args.get("items", 10),
-                city2=args.get("city2"),
-                city3=args.get("city3"),
-                uniq2=args.get("uniq2"),
-                uniq3=args.get("uniq3"),
-                countries=args.get("countries"),
-                regions=args.get("regions"),
-                operators=args.get("operators"),
-                datefrom=args.get("datefrom"),
-                dateto=args.get("dateto"),
-                stars=args.get("stars"),
-                meal=args.get("meal"),
-                rating=args.get("rating"),
-                max_days=args.get("maxdays"),
-                tour_type=args.get("tourtype", 0),
-                visa_free=args.get("visa") == 1,
-                sort_by_price=args.get("sort") == 1,
-                picturetype=args.get("picturetype", 0),
-                currency=args.get("currency", 0)
+            if warnings:
+                entry["warnings"] = warnings
+            ai_hotels.append(entry)
+
+        return {
+            "hotels_found": status.get("hotelsfound", len(hotels)),
+            "tours_found": status.get("toursfound", 0),
+            "hotels": ai_hotels,
+            "_hint": "Карточки с фото, ценами, датами, питанием, звёздами УЖЕ отображены фронтендом. НЕ перечисляй отели, цены, описания, даты, питание, звёзды в тексте! Напиши ТОЛЬКО краткий комментарий (1-2 предложения) и спроси клиента."
+        }
+    
+    async def _fn_get_dictionaries(self, args: Dict) -> Any:
+        """Справочники TourVisor (list.php)"""
+        # Определяем какой справочник запрашивается
+        dict_type = args.get("type", "")
+        
+        if "departure" in dict_type:
+            return await self.tourvisor.get_departures()
+        elif "country" in dict_type:
+            return await self.tourvisor.get_countries(args.get("cndep"))
+        elif "subregion" in dict_type:
+            return await self.tourvisor.get_subregions(args.get("regcountry"))
+        elif "region" in dict_type:
+            return await self.tourvisor.get_regions(args.get("regcountry"))
+        elif "meal" in dict_type:
+            return await self.tourvisor.get_meals()
+        elif "stars" in dict_type:
+            return await self.tourvisor.get_stars()
+        elif "operator" in dict_type:
+            return await self.tourvisor.get_operators(
+                args.get("flydeparture"),
+                args.get("flycountry")
             )
+        elif "services" in dict_type:
+            return await self.tourvisor.get_services()
+        elif "flydate" in dict_type:
+            return await self.tourvisor.get_flydates(
+                args.get("flydeparture"),
+                args.get("flycountry")
+            )
+        elif "hotel" in dict_type:
+            # Собираем типы отелей
+            hotel_types = []
+            for ht in ["active", "relax", "family", "health", "city", "beach", "deluxe"]:
+                if args.get(f"hot{ht}") == 1:
+                    hotel_types.append(ht)
             
-            # Сокращаем результаты для AI — формат карточек с картинками
-            simplified = []
-            for t in tours[:7]:  # Максимум 7 горящих туров
-                # Вычисляем скидку (безопасное преобразование — API отдаёт числа как строки)
-                price = _safe_int(t.get("price"))
-                price_old = _safe_int(t.get("priceold"))
-                discount = round((price_old - price) / price_old * 100) if price_old > 0 else 0
-                
-                # Проверяем картинку — не показываем заглушки
-                picture = t.get("hotelpicture", "")
-                has_real_photo = picture and "/reg-" not in picture
-                
-                simplified.append({
-                    "hotelcode": t.get("hotelcode"),
-                    "hotelname": t.get("hotelname"),
-                    "hotelstars": t.get("hotelstars"),
-                    "hotelrating": t.get("hotelrating"),
-                    "countryname": t.get("countryname"),
-                    "regionname": t.get("hotelregionname"),
-                    "departurename": t.get("departurename"),  # Город вылета
-                    "departurenamefrom": t.get("departurenamefrom"),  # "из Москвы"
-                    "operatorname": t.get("operatorname"),  # Туроператор
-                    "price_per_person": price,
-                    "price_old": price_old,
-                    "discount_percent": discount,
-                    "currency": t.get("currency", "RUB"),  # Валюта
-                    "flydate": t.get("flydate"),
-                    "nights": t.get("nights"),
-                    "meal": t.get("meal"),
-                    "tourid": t.get("tourid"),
-                    "picturelink": picture if has_real_photo else None,  # Только реальные фото
-                    "fulldesclink": t.get("fulldesclink")  # Ссылка
-                })
-            
-            # ── Строим tour_cards для нового фронтенда ──
-            self._pending_tour_cards = [
-                _map_hot_tour_to_card(t) for t in simplified
-            ]
-            logger.info("🎴 Built %d hot tour cards for frontend", len(self._pending_tour_cards))
-            
-            # ── Сокращённые данные для AI (без цен/дат/звёзд — они на карточках) ──
-            ai_tours = []
-            for t in simplified:
-                ai_tours.append({
-                    "hotelcode": t.get("hotelcode"),
-                    "hotelname": t.get("hotelname"),
-                })
-
-            return {
-                "total_found": len(tours),
-                "note": "ВАЖНО: Цены указаны ЗА ЧЕЛОВЕКА! Для двоих умножай на 2.",
-                "tours": ai_tours,
-                "_hint": "Карточки с фото, ценами, датами, питанием, звёздами УЖЕ отображены фронтендом. НЕ перечисляй отели, цены, описания, звёзды в тексте! Напиши ТОЛЬКО краткий комментарий и упомяни что цены за человека."
-            }
+            hotels = await self.tourvisor.get_hotels(
+                country_id=args.get("hotcountry"),
+                region_id=args.get("hotregion"),
+                stars=args.get("hotstars"),
+                rating=args.get("hotrating"),
+                hotel_types=hotel_types if hotel_types else None
+            )
+            # Фильтруем по названию если указано
+            name_filter = args.get("name", "").lower()
+            if name_filter:
+                hotels = [h for h in hotels if name_filter in h.get("name", "").lower()]
+            return hotels[:20]  # Максимум 20 отелей
+        elif "currency" in dict_type:
+            # Курсы валют туроператоров
+            return await self.tourvisor.get_currencies()
+        else:
+            return {"error": f"Неизвестный тип справочника: {dict_type}"}
+    
+    async def _fn_actualize_tour(self, args: Dict) -> Any:
+        """Актуализация цены тура"""
+        return await self.tourvisor.actualize_tour(
+            tour_id=args["tourid"],
+            request_mode=args.get("request", 2),
+            currency=args.get("currency", 0)
+        )
+    
+    async def _fn_get_tour_details(self, args: Dict) -> Any:
+        """Детали тура (рейсы, доплаты)"""
+        return await self.tourvisor.get_tour_details(
+            tour_id=args["tourid"],
+            currency=args.get("currency", 0)
+        )
+    
+    async def _fn_get_hotel_info(self, args: Dict) -> Any:
+        """Информация об отеле для карточки"""
+        include_reviews = args.get("reviews") == 1
+        hotel = await self.tourvisor.get_hotel_info(
+            hotel_code=args["hotelcode"],
+            big_images=True,  # Всегда большие картинки
+            remove_tags=True,  # Без HTML тегов
+            include_reviews=include_reviews
+        )
         
-        elif name == "continue_search":
-            result = await self.tourvisor.continue_search(args["requestid"])
-            page = result.get("page", "2")
-            return {
-                "page": page,
-                "message": f"Продолжение поиска запущено (страница {page}). Вызови get_search_status для ожидания завершения, затем get_search_results."
-            }
+        # Форматируем для карточки с полным описанием
+        images = hotel.get("images", {})
+        if isinstance(images, dict):
+            images = images.get("image", [])
+        if isinstance(images, str):
+            images = [images]
+        
+        reviews = hotel.get("reviews", {})
+        if isinstance(reviews, dict):
+            reviews = reviews.get("review", [])
+        
+        return {
+            "name": hotel.get("name"),
+            "stars": hotel.get("stars"),
+            "rating": hotel.get("rating"),
+            "country": hotel.get("country"),
+            "region": hotel.get("region"),
+            "placement": hotel.get("placement"),
+            "seadistance": hotel.get("seadistance"),
+            "build": hotel.get("build"),
+            "description": hotel.get("description"),
+            "territory": hotel.get("territory"),
+            "inroom": hotel.get("inroom"),
+            "roomtypes": hotel.get("roomtypes"),
+            "beach": hotel.get("beach"),
+            "child": hotel.get("child"),
+            "services": hotel.get("services"),
+            "servicefree": hotel.get("servicefree"),
+            "servicepay": hotel.get("servicepay"),
+            "meallist": hotel.get("meallist"),
+            "mealtypes": hotel.get("mealtypes"),
+            "animation": hotel.get("animation"),
+            "images": images[:5] if images else [],  # Первые 5 фото
+            "images_count": hotel.get("imagescount"),
+            "coordinates": {
+                "lat": hotel.get("coord1"),
+                "lon": hotel.get("coord2")
+            },
+            "reviews": [
+                {
+                    "name": r.get("name"),
+                    "rate": r.get("rate"),
+                    "content": _truncate(r.get("content", ""), 300),
+                    "traveltime": r.get("traveltime"),
+                    "sourcelink": r.get("sourcelink", "")  # ВАЖНО для указания источника!
+                } for r in (reviews[:3] if reviews else [])
+            ] if include_reviews else []
+        }
+    
+    async def _fn_get_hot_tours(self, args: Dict) -> Any:
+        """Горящие туры: tour_cards для фронтенда + краткий список для AI"""
+        tours = await self.tourvisor.get_hot_tours(
+            city=args["city"],
+            count=args.get("items", 10),
+            city2=args.get("city2"),
+            city3=args.get("city3"),
+            uniq2=args.get("uniq2"),
+            uniq3=args.get("uniq3"),
+            countries=args.get("countries"),
+            regions=args.get("regions"),
+            operators=args.get("operators"),
+            datefrom=args.get("datefrom"),
+            dateto=args.get("dateto"),
+            stars=args.get("stars"),
+            meal=args.get("meal"),
+            rating=args.get("rating"),
+            max_days=args.get("maxdays"),
+            tour_type=args.get("tourtype", 0),
+            visa_free=args.get("visa") == 1,
+            sort_by_price=args.get("sort") == 1,
+            picturetype=args.get("picturetype", 0),
+            currency=args.get("currency", 0)
+        )
         
-        else:
+        # Сокращаем результаты для AI — формат карточек с картинками
+        simplified = []
+        for t in tours[:7]:  # Максимум 7 горящих туров
+            # Вычисляем скидку (безопасное преобразование — API отдаёт числа как строки)
+            price = _safe_int(t.get("price"))
+            price_old = _safe_int(t.get("priceold"))
+            discount = round((price_old - price) / price_old * 100) if price_old > 0 else 0
+            
+            # Проверяем картинку — не показываем заглушки
+            picture = _real_photo(t.get("hotelpicture"))
+            
+            simplified.append({
+                "hotelcode": t.get("hotelcode"),
+                "hotelname": t.get("hotelname"),
+                "hotelstars": t.get("hotelstars"),
+                "hotelrating": t.get("hotelrating"),
+                "countryname": t.get("countryname"),
+                "regionname": t.get("hotelregionname"),
+                "departurename": t.get("departurename"),  # Город вылета
+                "departurenamefrom": t.get("departurenamefrom"),  # "из Москвы"
+                "operatorname": t.get("operatorname"),  # Туроператор
+                "price_per_person": price,
+                "price_old": price_old,
+                "discount_percent": discount,
+                "currency": t.get("currency", "RUB"),  # Валюта
+                "flydate": t.get("flydate"),
+                "nights": t.get("nights"),
+                "meal": t.get("meal"),
+                "tourid": t.get("tourid"),
+                "picturelink": picture,  # Только реальные фото
+                "fulldesclink": t.get("fulldesclink")  # Ссылка
+            })
+        
+        # ── Строим tour_cards для нового фронтенда ──
+        self._pending_tour_cards = [
+            _map_hot_tour_to_card(t) for t in simplified
+        ]
+        logger.info("🎴 Built %d hot tour cards for frontend", len(self._pending_tour_cards))
+        
+        # ── Сокращённые данные для AI (без цен/дат/звёзд — они на карточках) ──
+        ai_tours = []
+        for t in simplified:
+            ai_tours.append({
+                "hotelcode": t.get("hotelcode"),
+                "hotelname": t.get("hotelname"),
+            })
+
+        return {
+            "total_found": len(tours),
+            "note": "ВАЖНО: Цены указаны ЗА ЧЕЛОВЕКА! Для двоих умножай на 2.",
+            "tours": ai_tours,
+            "_hint": "Карточки с фото, ценами, датами, питанием, звёздами УЖЕ отображены фронтендом. НЕ перечисляй отели, цены, описания, звёзды в тексте! Напиши ТОЛЬКО краткий комментарий и упомяни что цены за человека."
+        }
+    
+    async def _fn_continue_search(self, args: Dict) -> Any:
+        """Продолжение поиска (следующая страница)"""
+        result = await self.tourvisor.continue_search(args["requestid"])
+        page = result.get("page", "2")
+        return {
+            "page": page,
+            "message": f"Продолжение поиска запущено (страница {page}). Вызови get_search_status для ожидания завершения, затем get_search_results."
+        }
+    
+    # Имя функции → обработчик: одна выборка из словаря вместо цепочки if/elif
+    _FUNCTION_HANDLERS = {
+        "get_current_date": _fn_get_current_date,
+        "search_tours": _fn_search_tours,
+        "get_search_status": _fn_get_search_status,
+        "get_search_results": _fn_get_search_results,
+        "get_dictionaries": _fn_get_dictionaries,
+        "actualize_tour": _fn_actualize_tour,
+        "get_tour_details": _fn_get_tour_details,
+        "get_hotel_info": _fn_get_hotel_info,
+        "get_hot_tours": _fn_get_hot_tours,
+        "continue_search": _fn_continue_search,
+    }
+    
+    async def _execute_function_calls(self, calls: List[Tuple[str, str, str]]) -> List[Dict]:
+        """
+        Выполнить вызовы функций из одного ответа модели: (name, arguments, call_id).
+        Подряд идущие вызовы из _PARALLEL_SAFE_FUNCTIONS — параллельно, остальные — по очереди
+        в исходном порядке (каждый ждёт завершения всех предыдущих). Результаты — в исходном порядке.
+        """
+        results: List[Dict] = []
+        batch: List[Tuple[str, str, str]] = []
+        for call in calls:
+            if call[0] in _PARALLEL_SAFE_FUNCTIONS:
+                batch.append(call)
+                continue
+            if batch:
+                results.extend(await asyncio.gather(*(self._execute_function(*c) for c in batch)))
+                batch = []
+            results.append(await self._execute_function(*call))
+        if batch:
+            results.extend(await asyncio.gather(*(self._execute_function(*c) for c in batch)))
+        return results
+    
+    async def _dispatch_function(self, name: str, args: Dict) -> Any:
+        """Маршрутизация вызовов функций к TourVisor клиенту"""
+        fn = self._FUNCTION_HANDLERS.get(name)
+        if fn is None:
             return {"error": f"Неизвестная функция: {name}"}
+        return await fn(self, args)
     
     def _call_api_sync(self, stream: bool = False):
         """
@@ -1370,41 +1549,28 @@ class YandexGPTHandler:
                 return "Произошла временная ошибка. Попробуйте ещё раз или начните новый чат."
             
             # Проверяем function calls
-            has_function_calls = False
-            function_results = []
+            function_calls = [
+                item for item in response.output
+                if getattr(item, 'type', None) == "function_call"
+            ]
+            has_function_calls = bool(function_calls)
             
-            for item in response.output:
-                if getattr(item, 'type', None) == "function_call":
-                    has_function_calls = True
-                    func_name = getattr(item, 'name', '')
-                    func_args = getattr(item, 'arguments', '{}')
-                    call_id = getattr(item, 'call_id', func_name)
-                    result = await self._execute_function(func_name, func_args, call_id)
-                    function_results.append(result)
+            # Справочные вызовы — параллельно, поиск/статус/результаты — в порядке модели
+            function_results = await self._execute_function_calls([
+                (
+                    getattr(item, 'name', ''),
+                    getattr(item, 'arguments', '{}'),
+                    getattr(item, 'call_id', getattr(item, 'name', ''))
+                )
+                for item in function_calls
+            ])
             
             if has_function_calls:
-                # Собираем summary функций для full_history (на случай fallback)
-                # ⚡ Увеличен лимит до 1500 символов — при 500 терялся контекст
-                #    (особенно данные отелей, цен и дат из search_results)
-                func_summary_parts = []
-                for result in function_results:
-                    call_id = result.get("call_id", "")
-                    output = result.get("output", "")
-                    # Найдём имя функции по call_id
-                    for item in response.output:
-                        if getattr(item, 'call_id', '') == call_id:
-                            func_name = getattr(item, 'name', '?')
-                            # Для search_results и hotel_info — больше контекста (содержат карточки)
-                            limit = 2000 if func_name in ('get_search_results', 'get_hotel_info', 'get_hot_tours') else 1000
-                            func_summary_parts.append(f"[{func_name}]: {output[:limit]}")
-                            break
-                
-                # В full_history сохраняем как assistant-сообщение (для fallback без previous_response_id)
-                if func_summary_parts:
-                    self.full_history.append({
-                        "role": "assistant",
-                        "content": "Результаты запросов:\n" + "\n".join(func_summary_parts)
-                    })
+                # Summary функций в full_history (на случай fallback)
+                self._remember_function_results(
+                    [getattr(item, 'name', '?') for item in function_calls],
+                    function_results
+                )
                 
                 # input_list = только function results (function_calls в previous_response_id)
                 self.input_list = function_results
@@ -1603,33 +1769,32 @@ class YandexGPTHandler:
                 return "Произошла временная ошибка связи. Попробуйте ещё раз или начните новый чат."
             
             # Обрабатываем streaming ответ
-            full_text = ""
+            text_parts: List[str] = []
             has_function_calls = False
             function_calls_data = []
             output_items = []  # Собираем все output items
             response_id = None
-            token_count = 0
             
             # Итерируем по событиям streaming
             for event in stream_response:
                 event_type = getattr(event, 'type', None)
                 
-                # Сохраняем response_id
-                if hasattr(event, 'response') and event.response:
-                    response_id = getattr(event.response, 'id', None)
-                
-                # Текстовый контент (delta)
+                # Текстовый контент (delta) — самый частый тип события, проверяем первым
                 if event_type == "response.output_text.delta":
                     delta_text = getattr(event, 'delta', '')
                     if delta_text:
-                        full_text += delta_text
-                        token_count += 1
+                        text_parts.append(delta_text)
                         # Вызываем callback для каждого токена
                         if on_token:
                             on_token(delta_text)
+                    continue
+                
+                # Сохраняем response_id
+                if hasattr(event, 'response') and event.response:
+                    response_id = getattr(event.response, 'id', None)
                 
                 # Output item - собираем все items (function_call, message, web_search, etc)
-                elif event_type == "response.output_item.done":
+                if event_type == "response.output_item.done":
                     event_data = event.model_dump() if hasattr(event, 'model_dump') else {}
                     item = event_data.get('item', {})
                     item_type = item.get('type', '')
@@ -1655,6 +1820,9 @@ class YandexGPTHandler:
                     if hasattr(event, 'response'):
                         response_id = getattr(event.response, 'id', None)
             
+            full_text = "".join(text_parts)
+            token_count = len(text_parts)
+            
             # ⚡ Сохраняем ID ТОЛЬКО если ответ не пустой
             if response_id and (output_items or full_text):
                 self.previous_response_id = response_id
@@ -1671,31 +1839,17 @@ class YandexGPTHandler:
                 # Сбрасываем счётчик пустых итераций
                 self._empty_iterations = 0
                 
-                # Выполняем функции
-                function_results = []
-                for fc in function_calls_data:
-                    result = await self._execute_function(
-                        fc["name"], 
-                        fc["arguments"], 
-                        fc["call_id"]
-                    )
-                    function_results.append(result)
-                
-                # Собираем summary для full_history (fallback)
-                # ⚡ Увеличен лимит — при 500 терялся контекст карточек
-                func_summary_parts = []
-                for i, result in enumerate(function_results):
-                    fc = function_calls_data[i] if i < len(function_calls_data) else {}
-                    output = result.get("output", "")
-                    func_name = fc.get('name', '?')
-                    limit = 2000 if func_name in ('get_search_results', 'get_hotel_info', 'get_hot_tours') else 1000
-                    func_summary_parts.append(f"[{func_name}]: {output[:limit]}")
+                # Справочные вызовы — параллельно, поиск/статус/результаты — в порядке модели
+                function_results = await self._execute_function_calls([
+                    (fc["name"], fc["arguments"], fc["call_id"])
+                    for fc in function_calls_data
+                ])
                 
-                if func_summary_parts:
-                    self.full_history.append({
-                        "role": "assistant",
-                        "content": "Результаты запросов:\n" + "\n".join(func_summary_parts)
-                    })
+                # Summary функций в full_history (fallback)
+                self._remember_function_results(
+                    [fc["name"] for fc in function_calls_data],
+                    function_results
+                )
                 
                 # input_list = только function results (output_items в previous_response_id)
                 self.input_list = function_results
@@ -1884,6 +2038,7 @@ class YandexGPTHandler:
         self._empty_iterations = 0
         self._pending_tour_cards = []
         self._last_departure_city = "Москва"
+        self._cascade_passed = False
         logger.info("🔄 HANDLER RESET  cleared %d messages from full_history", old_len)
 
 